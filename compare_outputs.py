@@ -0,0 +1,175 @@
+import argparse
+import copy
+import os
+import ROOT as pyr
+import yaml
+import make_histograms as mh
+from make_datacards import YIELDS_FILENAME
+
+def values_close(a, b, rtol, atol):
+    return abs(a - b) <= atol + rtol * max(abs(a), abs(b))
+
+def bin_label(hist, i):
+    if i == 0: return "underflow"
+    if i == hist.GetNbinsX() + 1: return "overflow"
+    return f"bin {i}"
+
+def compare_histograms(name, ref, cand, rtol, atol):
+    # Compares binning, contents and sumw2 of all bins including under/overflow
+    if ref.GetNbinsX() != cand.GetNbinsX() or not values_close(ref.GetXaxis().GetXmin(), cand.GetXaxis().GetXmin(), rtol, atol) or not values_close(ref.GetXaxis().GetXmax(), cand.GetXaxis().GetXmax(), rtol, atol):
+        return [f"{name}: binning differs, ({ref.GetNbinsX()}, {ref.GetXaxis().GetXmin()}, {ref.GetXaxis().GetXmax()}) vs ({cand.GetNbinsX()}, {cand.GetXaxis().GetXmin()}, {cand.GetXaxis().GetXmax()})"]
+    mismatches = []
+    if (ref.GetSumw2N() > 0) != (cand.GetSumw2N() > 0):
+        mismatches.append(f"{name}: sumw2 stored in only one of the histograms")
+    for i in range(ref.GetNbinsX() + 2):
+        content_ref, content_cand = ref.GetBinContent(i), cand.GetBinContent(i)
+        if not values_close(content_ref, content_cand, rtol, atol):
+            mismatches.append(f"{name} {bin_label(ref, i)}: content {content_ref:.9g} vs {content_cand:.9g}")
+        sumw2_ref, sumw2_cand = ref.GetBinError(i)**2, cand.GetBinError(i)**2
+        if not values_close(sumw2_ref, sumw2_cand, rtol, atol):
+            mismatches.append(f"{name} {bin_label(ref, i)}: sumw2 {sumw2_ref:.9g} vs {sumw2_cand:.9g}")
+    return mismatches
+
+def compare_root_files(ref_path, cand_path, rtol, atol):
+    ref_file = pyr.TFile.Open(ref_path, "READ")
+    cand_file = pyr.TFile.Open(cand_path, "READ")
+    ref_names = set(key.GetName() for key in ref_file.GetListOfKeys())
+    cand_names = set(key.GetName() for key in cand_file.GetListOfKeys())
+    mismatches = [f"{name}: missing in candidate" for name in sorted(ref_names - cand_names)]
+    mismatches += [f"{name}: missing in reference" for name in sorted(cand_names - ref_names)]
+    for name in sorted(ref_names & cand_names):
+        ref, cand = ref_file.Get(name), cand_file.Get(name)
+        if not ref.InheritsFrom("TH1") or not cand.InheritsFrom("TH1"): continue
+        mismatches += compare_histograms(name, ref, cand, rtol, atol)
+    ref_file.Close()
+    cand_file.Close()
+    return mismatches
+
+def compare_datacards(ref_path, cand_path, rtol, atol, count_atol):
+    """
+    Compares datacards line by line.
+    observation counts and norm_match_mc_data are compared numerically, norm_match_mc_data at least to its printed precision,
+    all other lines must be identical.
+    """
+    with open(ref_path, "r") as ref_file: ref_lines = ref_file.read().splitlines()
+    with open(cand_path, "r") as cand_file: cand_lines = cand_file.read().splitlines()
+    if len(ref_lines) != len(cand_lines): return [f"number of lines differs, {len(ref_lines)} vs {len(cand_lines)}"]
+    mismatches = []
+    for lineno, (ref_line, cand_line) in enumerate(zip(ref_lines, cand_lines), start=1):
+        ref_fields, cand_fields = ref_line.split(), cand_line.split()
+        if ref_fields[:1] == ["observation"] and cand_fields[:1] == ["observation"] and len(ref_fields) == len(cand_fields):
+            for channel, ref_count, cand_count in zip(["pass", "fail"], ref_fields[1:], cand_fields[1:]):
+                if not values_close(float(ref_count), float(cand_count), 0, count_atol):
+                    mismatches.append(f"observation {channel}: {ref_count} vs {cand_count}")
+        elif ref_fields[:2] == ["norm_match_mc_data", "rateParam"] and cand_fields[:4] == ref_fields[:4]:
+            if not values_close(float(ref_fields[4]), float(cand_fields[4]), rtol, max(atol, 1e-6)):
+                mismatches.append(f"norm_match_mc_data: {ref_fields[4]} vs {cand_fields[4]}")
+        elif ref_line != cand_line:
+            mismatches.append(f"line {lineno}: '{ref_line}' vs '{cand_line}'")
+    return mismatches
+
+def compare_yields(ref_path, cand_path, rtol, atol):
+    with open(ref_path, "r") as ref_file: ref_yields = yaml.safe_load(ref_file)
+    with open(cand_path, "r") as cand_file: cand_yields = yaml.safe_load(cand_file)
+    if set(ref_yields.keys()) != set(cand_yields.keys()): return ["event categories differ"]
+    mismatches = []
+    for key in ref_yields.keys():
+        for name, value in ref_yields[key].items():
+            if not values_close(value, cand_yields[key][name], rtol, atol): mismatches.append(f"{key} {name}: {value:.9g} vs {cand_yields[key][name]:.9g}")
+    return mismatches
+
+def compare_text_files(ref_path, cand_path):
+    with open(ref_path, "r") as ref_file: ref_text = ref_file.read()
+    with open(cand_path, "r") as cand_file: cand_text = cand_file.read()
+    return [] if ref_text == cand_text else ["text differs"]
+
+def compare_outputs(ref_dir, cand_dir, rtol=1e-6, atol=1e-9, count_atol=0):
+    """
+    Compares all outputs of make_histograms.py in two directories.
+    Returns {filename: list of mismatches}, including files with no mismatch.
+    Bootstrap replicas (.npz) are not compared, since they are only filled by the rdf engine.
+    {key}_unfloored.root files hold the analysis histograms before check_zero_bins, so differences in empty bins are not hidden by the 0.01 floor.
+    """
+    ref_files = set(name for name in os.listdir(ref_dir) if not name.endswith(".npz"))
+    cand_files = set(name for name in os.listdir(cand_dir) if not name.endswith(".npz"))
+    results = {}
+    for name in sorted(ref_files | cand_files):
+        ref_path, cand_path = os.path.join(ref_dir, name), os.path.join(cand_dir, name)
+        if name not in cand_files: results[name] = ["missing in candidate"]
+        elif name not in ref_files: results[name] = ["missing in reference"]
+        elif name.endswith(".root"): results[name] = compare_root_files(ref_path, cand_path, rtol, atol)
+        elif name.endswith(".txt"): results[name] = compare_datacards(ref_path, cand_path, rtol, atol, count_atol)
+        elif name == YIELDS_FILENAME: results[name] = compare_yields(ref_path, cand_path, rtol, atol)
+        else: results[name] = compare_text_files(ref_path, cand_path)
+    return results
+
+def print_comparison_report(results, max_lines=10):
+    print("===========================")
+    nmismatches = sum(len(mismatches) for mismatches in results.values())
+    for name, mismatches in results.items():
+        if not mismatches:
+            print(f"OK        {name}")
+            continue
+        print(f"MISMATCH  {name}: {len(mismatches)} difference(s)")
+        for mismatch in mismatches[:max_lines]: print(f"    {mismatch}")
+        if len(mismatches) > max_lines: print(f"    ... and {len(mismatches) - max_lines} more")
+    if nmismatches == 0: print(f"All {len(results)} output files match")
+    else: print(f"{nmismatches} difference(s) in {sum(1 for mismatches in results.values() if mismatches)} of {len(results)} output files")
+
+def run_configuration(yaml_spec, outdir, engine, diagnosis=False):
+    # Runs make_histograms.py in this process with the outputs redirected to outdir
+    config_spec = copy.deepcopy(yaml_spec)
+    config_spec["analysisname"] = outdir
+    if not os.path.isdir(outdir): os.makedirs(outdir)
+    print(f"Debug: making histograms with engine {engine} in {outdir}")
+    mh.make_histograms(config_spec, diagnosis=diagnosis, engine=engine, unfloored=True)
+    if diagnosis:
+        # make_histograms.py writes diagnosis files to the current directory
+        for event_catname, _ in mh.read_settings(config_spec)["event_categories"]:
+            os.replace(f"diagnosis_{event_catname}.root", os.path.join(outdir, f"diagnosis_{event_catname}.root"))
+
+def missing_perfileweights(yaml_spec, settings):
+    # perfileweights branches are added to the input files by make_histograms.py, compare_outputs.py only reads the inputs
+    missing = []
+    for weightset in yaml_spec.get("perfileweights", []):
+        for filename in weightset["files"]:
+            rootfile = pyr.TFile.Open(filename, "READ")
+            if not rootfile.Get(settings["treename"]).GetBranch(weightset["name"]): missing.append(f"{filename}: branch {weightset['name']}")
+            rootfile.Close()
+    return missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, same as input for make_histograms.py", nargs="?", default=None)
+    parser.add_argument("--reference", help="Engine of the reference configuration (default: project)", choices=["formula", "project", "rdf"], default="project")
+    parser.add_argument("--candidate", help="Engine of the candidate configuration (default: formula)", choices=["formula", "project", "rdf"], default="formula")
+    parser.add_argument("--workdir", help="Directory for the outputs of both configurations (default: {analysisname}_compare, or compare if analysisname is not set)", default=None)
+    parser.add_argument("--diagnosis", help="Also make and compare diagnosis files", action="store_true")
+    parser.add_argument("--dirs", help="Only compare two existing output directories, without making histograms", nargs=2, metavar=("REFERENCE_DIR", "CANDIDATE_DIR"), default=None)
+    parser.add_argument("--rtol", help="Relative tolerance for bin contents, sumw2 and norm_match_mc_data (default: 1e-6)", type=float, default=1e-6)
+    parser.add_argument("--atol", help="Absolute tolerance for bin contents and sumw2 (default: 1e-9)", type=float, default=1e-9)
+    parser.add_argument("--count-atol", help="Absolute tolerance for observation counts in datacards (default: 0)", type=float, default=0)
+    parser.add_argument("--max-lines", help="Maximum number of differences printed per file (default: 10)", type=int, default=10)
+    args = parser.parse_args()
+    if args.dirs is None and args.yamlpath is None: parser.error("either yamlpath or --dirs is required")
+
+    if args.dirs is not None:
+        ref_dir, cand_dir = args.dirs
+    else:
+        with open(args.yamlpath, "r") as yamlfile:
+            yaml_spec = yaml.safe_load(yamlfile)
+        settings = mh.read_settings(yaml_spec)
+        workdir = args.workdir
+        if workdir is None: workdir = "compare" if settings["analysis_name"] == "." else f"{settings['analysis_name'].rstrip('/')}_compare"
+        ref_dir = os.path.join(workdir, f"reference_{args.reference}")
+        cand_dir = os.path.join(workdir, f"candidate_{args.candidate}")
+        missing = missing_perfileweights(yaml_spec, settings)
+        if missing:
+            for line in missing: print(f"Missing perfileweights {line}")
+            raise SystemExit("Run make_histograms.py on the spec once to add the perfileweights branches, compare_outputs.py does not modify input files")
+        run_configuration(yaml_spec, ref_dir, args.reference, diagnosis=args.diagnosis)
+        run_configuration(yaml_spec, cand_dir, args.candidate, diagnosis=args.diagnosis)
+
+    results = compare_outputs(ref_dir, cand_dir, rtol=args.rtol, atol=args.atol, count_atol=args.count_atol)
+    print_comparison_report(results, max_lines=args.max_lines)
+    if any(results.values()): raise SystemExit(1)
@@ -0,0 +1,156 @@
+import argparse
+import math
+import os
+import tempfile
+import numpy as np
+import ROOT as pyr
+import yaml
+
+DEFAULT_BRANCHES = ["run", "luminosityBlock", "event"]
+CHUNK_SIZE = 5000000
+MAX_RECORDS_PER_PARTITION = 20000000
+
+RECORD_DTYPE = np.dtype([("run", "u8"), ("lumi", "u8"), ("event", "u8"), ("file", "u4"), ("entry", "i8")])
+
+def mix64(x):
+    # SplitMix64 finaliser on uint64 arrays, used to spread events evenly over partitions
+    x = x + np.uint64(0x9e3779b97f4a7c15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+READ_CODE = """
+#include "TLeaf.h"
+namespace topsf {
+// Reads three integer branches of entries [first, first+n) into uint64 arrays.
+// TTree::Draw goes through double, which merges event numbers above 2^53.
+void read_integer_branches(TTree* tree, const std::vector<std::string>& branches, Long64_t first, Long64_t n,
+                           std::uint64_t* run, std::uint64_t* lumi, std::uint64_t* event) {
+    std::uint64_t* outputs[3] = {run, lumi, event};
+    std::vector<TLeaf*> leaves;
+    for (const auto& name : branches) {
+        TLeaf* leaf = tree->GetLeaf(name.c_str());
+        if (leaf == nullptr) throw std::runtime_error("branch " + name + " not found");
+        leaves.push_back(leaf);
+    }
+    for (Long64_t i = 0; i < n; i++) {
+        const Long64_t entry = tree->LoadTree(first + i);
+        for (size_t b = 0; b < 3; b++) {
+            leaves[b]->GetBranch()->GetEntry(entry);
+            outputs[b][i] = (std::uint64_t) leaves[b]->GetValueLong64();
+        }
+    }
+}
+}
+"""
+READ_DECLARED = False
+
+def declare_read_code():
+    global READ_DECLARED
+    if READ_DECLARED: return
+    pyr.gInterpreter.Declare(READ_CODE)
+    READ_DECLARED = True
+
+def read_event_ids(filename, treename, branches, chunksize=CHUNK_SIZE):
+    # Yields (first entry, run, lumi, event) chunk by chunk, so that memory does not grow with the file size
+    # Branches are read as 64-bit integers, so event numbers are exact over the whole 64-bit range
+    declare_read_code()
+    fileobj = pyr.TFile.Open(filename, "READ")
+    treeobj = fileobj.Get(treename)
+    nentries = treeobj.GetEntries()
+    branch_vector = pyr.std.vector["std::string"](branches)
+    for first in range(0, nentries, chunksize):
+        n = min(chunksize, nentries - first)
+        columns = [np.zeros(n, dtype=np.uint64) for _ in range(3)]
+        pyr.topsf.read_integer_branches(treeobj, branch_vector, first, n, columns[0], columns[1], columns[2])
+        yield first, columns[0], columns[1], columns[2]
+    fileobj.Close()
+
+def find_duplicates(filelist, treename, branches=DEFAULT_BRANCHES, workdir=None):
+    """
+    Finds events appearing more than once across filelist, identified by the three branches (run, lumi, event).
+    The first occurrence, in the order of filelist, is kept.
+    Records are spread over partition files on disk by a hash of the event ID, and each partition is sorted separately,
+    so memory usage is bounded by the partition size rather than the total number of events.
+    Returns ({filename: sorted array of entries to exclude}, {(kept filename, removed filename): count}).
+    """
+    nentries = []
+    for filename in filelist:
+        fileobj = pyr.TFile.Open(filename, "READ")
+        nentries.append(fileobj.Get(treename).GetEntries())
+        fileobj.Close()
+    npartitions = max(1, math.ceil(sum(nentries) / MAX_RECORDS_PER_PARTITION))
+
+    excluded = {filename: [] for filename in filelist}
+    pair_counts = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        partition_paths = [os.path.join(tmpdir, f"partition_{i}.bin") for i in range(npartitions)]
+        partition_files = [open(path, "wb") for path in partition_paths]
+        for fileindex, filename in enumerate(filelist):
+            print(f"Debug: reading event IDs from {filename}")
+            for first, run, lumi, event in read_event_ids(filename, treename, branches):
+                records = np.empty(len(event), dtype=RECORD_DTYPE)
+                records["run"] = run
+                records["lumi"] = lumi
+                records["event"] = event
+                records["file"] = fileindex
+                records["entry"] = np.arange(first, first + len(event))
+                partition = mix64(event ^ mix64(run ^ (lumi << np.uint64(32)))) % np.uint64(npartitions)
+                for i in np.unique(partition):
+                    records[partition == i].tofile(partition_files[i])
+        for partition_file in partition_files: partition_file.close()
+
+        for path in partition_paths:
+            records = np.fromfile(path, dtype=RECORD_DTYPE)
+            if len(records) == 0: continue
+            records = records[np.lexsort((records["entry"], records["file"], records["event"], records["lumi"], records["run"]))]
+            same_as_previous = np.zeros(len(records), dtype=bool)
+            same_as_previous[1:] = (
+                (records["run"][1:] == records["run"][:-1])
+                & (records["lumi"][1:] == records["lumi"][:-1])
+                & (records["event"][1:] == records["event"][:-1])
+            )
+            if not same_as_previous.any(): continue
+            # Index of the first occurrence for every record, duplicates are counted against the kept file
+            first_index = np.maximum.accumulate(np.where(same_as_previous, 0, np.arange(len(records))))
+            duplicates = np.nonzero(same_as_previous)[0]
+            kept_files = records["file"][first_index[duplicates]]
+            removed_files = records["file"][duplicates]
+            for fileindex in np.unique(removed_files):
+                excluded[filelist[fileindex]].append(records["entry"][duplicates][removed_files == fileindex])
+            pairs, counts = np.unique(np.stack([kept_files, removed_files], axis=1), axis=0, return_counts=True)
+            for (kept, removed), count in zip(pairs, counts):
+                pair_key = (filelist[kept], filelist[removed])
+                pair_counts[pair_key] = pair_counts.get(pair_key, 0) + int(count)
+
+    for filename in filelist:
+        excluded[filename] = np.sort(np.concatenate(excluded[filename])) if excluded[filename] else np.zeros(0, dtype=np.int64)
+    return excluded, pair_counts
+
+def print_duplicate_report(pair_counts):
+    print("===========================")
+    if not pair_counts:
+        print("No duplicate events found")
+        return
+    print(f"Removed {sum(pair_counts.values())} duplicate events:")
+    for (kept, removed), count in sorted(pair_counts.items()):
+        print(f"  {count} events in {removed} already in {kept}")
+
+def save_duplicate_report(pair_counts, filename):
+    report = [{"kept_file": kept, "removed_file": removed, "count": count} for (kept, removed), count in sorted(pair_counts.items())]
+    with open(filename, "w") as reportfile:
+        yaml.safe_dump(report, reportfile)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, same as input for make_histograms.py")
+    parser.add_argument("--output", help="Save the duplicate report to this YAML file", default=None)
+    args = parser.parse_args()
+
+    with open(args.yamlpath, "r") as yamlfile:
+        yaml_spec = yaml.safe_load(yamlfile)
+
+    data_config = yaml_spec["processes"]["data"]
+    _, pair_counts = find_duplicates(data_config["nominal_files"], yaml_spec["treename"], data_config.get("dedup_branches", DEFAULT_BRANCHES))
+    print_duplicate_report(pair_counts)
+    if args.output is not None: save_duplicate_report(pair_counts, args.output)
@@ -0,0 +1,328 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from scipy.optimize import minimize
+import ROOT as pyr
+import yaml
+
+SF_RANGE = (0., 2.)
+NUISANCE_RANGE = (-5., 5.)
+CHANNELS = ["pass", "fail"]
+
+def hist_to_numpy(hist):
+    nbins = hist.GetNbinsX()
+    content = np.array([hist.GetBinContent(i) for i in range(1, nbins+1)])
+    error = np.array([hist.GetBinError(i) for i in range(1, nbins+1)])
+    return content, error
+
+def smooth_step(x):
+    # Same polynomial as the vertical template morphing in HiggsCombine
+    return np.where(np.abs(x) >= 1, np.sign(x), 0.125*x*(x*x*(3*x*x - 10) + 15))
+
+def morph_delta(x, delta_up, delta_down):
+    # Quadratic interpolation inside [-1, 1], linear extrapolation outside, as done for shape nuisances in HiggsCombine
+    inside = 0.5*x*((delta_up - delta_down) + (delta_up + delta_down)*smooth_step(x))
+    outside = np.where(x > 0, x*delta_up, -x*delta_down)
+    return np.where(np.abs(x) < 1, inside, outside)
+
+def lnn_log_kappas(value):
+    # log(kappa_down), log(kappa_up) of an lnN size as written in the datacard, either kappa or kappa_down/kappa_up
+    parts = str(value).split("/")
+    try:
+        kappas = [float(part) for part in parts]
+    except ValueError:
+        raise ValueError(f"lnN size '{value}' must be a number or kappa_down/kappa_up")
+    if len(kappas) > 2 or min(kappas) <= 0: raise ValueError(f"lnN size '{value}' must be a positive number or kappa_down/kappa_up")
+    if len(kappas) == 1: return -np.log(kappas[0]), np.log(kappas[0])
+    return np.log(kappas[0]), np.log(kappas[1])
+
+def lnn_exponent(x, logkappa_down, logkappa_up):
+    # Exponent of the lnN yield factor, with the smooth interpolation of asymmetric kappas for |x| < 0.5 used in HiggsCombine
+    # logkappa_down is log(kappa_down), the yield at x = -1 is exp(logkappa_down)
+    return 0.5*x*((logkappa_up - logkappa_down) + (logkappa_up + logkappa_down)*smooth_step(2*x))
+
+class TemplateFitModel(object):
+    """
+    Binned Poisson likelihood for one event category, following the TagAndProbeExtended model:
+    passing yields are scaled by SF, failing yields are scaled so that P+F is preserved.
+    Array shapes: nominal (2, categories, bins), shape_up/down (shape nuisances, 2, categories, bins),
+    shape_scale (shape nuisances, categories), lnn_logkappa/lnn_logkappa_down (lnN nuisances, categories), data (2, bins).
+    shape_scale is the shape size of the datacard, 0 where the shape uncertainty does not apply (default 1 everywhere).
+    lnn_logkappa_down is log(kappa_down) for asymmetric lnN uncertainties (default -lnn_logkappa, symmetric).
+    """
+    def __init__(self, categories, nominal, nominal_error, shape_names, shape_up, shape_down, lnn_names, lnn_logkappa, data, norm, mcstats=True, shape_scale=None, lnn_logkappa_down=None):
+        self.categories = list(categories)
+        self.nominal = nominal
+        self.nominal_error = nominal_error
+        self.shape_names = list(shape_names)
+        self.delta_up = shape_up - nominal[None]
+        self.delta_down = shape_down - nominal[None]
+        self.shape_scale = np.ones((len(self.shape_names), len(self.categories))) if shape_scale is None else shape_scale
+        self.lnn_names = list(lnn_names)
+        self.lnn_logkappa = lnn_logkappa
+        self.lnn_logkappa_down = -lnn_logkappa if lnn_logkappa_down is None else lnn_logkappa_down
+        self.data = data
+        self.norm = norm
+        self.mcstats = mcstats
+        self.pass_over_fail = nominal[0].sum(axis=1) / nominal[1].sum(axis=1)
+
+        self.param_names = [f"SF_{category}" for category in self.categories] + self.shape_names + self.lnn_names
+        self.ncategories = len(self.categories)
+        self.nshapes = len(self.shape_names)
+        self.bounds = [SF_RANGE]*self.ncategories + [NUISANCE_RANGE]*(self.nshapes + len(self.lnn_names))
+
+    def initial_params(self):
+        return np.concatenate([np.ones(self.ncategories), np.zeros(len(self.param_names) - self.ncategories)])
+
+    def split_params(self, params):
+        sf = params[:self.ncategories]
+        theta_shape = params[self.ncategories:self.ncategories+self.nshapes]
+        theta_lnn = params[self.ncategories+self.nshapes:]
+        return sf, theta_shape, theta_lnn
+
+    def expected_per_category(self, params):
+        sf, theta_shape, theta_lnn = self.split_params(params)
+        # Same as a shape size in the datacard: the templates are reached at theta = 1/size
+        x_shape = (theta_shape[:, None] * self.shape_scale)[:, None, :, None]
+        templates = self.nominal + morph_delta(x_shape, self.delta_up, self.delta_down).sum(axis=0)
+        templates = np.maximum(templates, 0.)
+        templates = templates * np.exp(lnn_exponent(theta_lnn[:, None], self.lnn_logkappa_down, self.lnn_logkappa).sum(axis=0))[None, :, None]
+        fail_scale = np.maximum(1 + (1 - sf)*self.pass_over_fail, 0.)
+        scale = np.stack([sf, fail_scale])
+        return self.norm * templates * scale[:, :, None], self.norm * self.nominal_error * scale[:, :, None]
+
+    def nll(self, params):
+        _, theta_shape, theta_lnn = self.split_params(params)
+        expected, expected_error = self.expected_per_category(params)
+        total = np.maximum(expected.sum(axis=1), 1e-9)
+        if self.mcstats:
+            # Barlow-Beeston-lite: one Gaussian-constrained nuisance per bin, profiled analytically
+            rel = np.sqrt((expected_error**2).sum(axis=1)) / total
+            b = 1 + total*rel**2
+            c = rel*(total - self.data)
+            safe_rel = np.where(rel > 1e-12, rel, 1.)
+            beta = np.where(
+                rel > 1e-12,
+                (-b + np.sqrt(np.maximum(b*b - 4*rel*c, 0.))) / (2*safe_rel),
+                -c / b
+            )
+            total = np.maximum(total*(1 + beta*rel), 1e-9)
+            constraint = 0.5*(beta**2).sum()
+        else:
+            constraint = 0.
+        poisson = (total - self.data*np.log(total)).sum()
+        return poisson + constraint + 0.5*(theta_shape**2).sum() + 0.5*(theta_lnn**2).sum()
+
+    def yields(self, params):
+        expected, _ = self.expected_per_category(params)
+        return np.concatenate([expected.reshape(-1), expected.sum(axis=1).reshape(-1)])
+
+    def split_yields(self, flat):
+        nbins = self.nominal.shape[2]
+        per_category = flat[:2*self.ncategories*nbins].reshape(2, self.ncategories, nbins)
+        total = flat[2*self.ncategories*nbins:].reshape(2, nbins)
+        return per_category, total
+
+def numerical_hessian(func, params, step=1e-3):
+    npar = len(params)
+    shifts = np.eye(npar)*step
+    hessian = np.zeros((npar, npar))
+    for i in range(npar):
+        for j in range(i, npar):
+            value = (
+                func(params + shifts[i] + shifts[j]) - func(params + shifts[i] - shifts[j])
+                - func(params - shifts[i] + shifts[j]) + func(params - shifts[i] - shifts[j])
+            ) / (4*step*step)
+            hessian[i, j] = value
+            hessian[j, i] = value
+    return hessian
+
+def numerical_jacobian(func, params, step=1e-4):
+    columns = []
+    for i in range(len(params)):
+        shift = np.zeros(len(params))
+        shift[i] = step
+        columns.append((func(params + shift) - func(params - shift)) / (2*step))
+    return np.stack(columns, axis=1)
+
+def propagate_yields(model, params, covariance):
+    flat = model.yields(params)
+    jacobian = numerical_jacobian(model.yields, params)
+    variance = np.einsum("ij,jk,ik->i", jacobian, covariance, jacobian)
+    per_category, total = model.split_yields(flat)
+    per_category_var, total_var = model.split_yields(variance)
+    _, stat_error = model.expected_per_category(params)
+    per_category_error = np.sqrt(per_category_var + stat_error**2)
+    total_error = np.sqrt(total_var + (stat_error**2).sum(axis=1))
+    return per_category, per_category_error, total, total_error
+
+def fit_event_category(model):
+    result = minimize(model.nll, model.initial_params(), method="L-BFGS-B", bounds=model.bounds)
+    hessian = numerical_hessian(model.nll, result.x)
+    covariance = np.linalg.pinv(hessian)
+
+    prefit_params = model.initial_params()
+    prefit_covariance = np.diag([0.]*model.ncategories + [1.]*(len(model.param_names) - model.ncategories))
+    return {
+        "success": result.success,
+        "message": str(result.message),
+        "nll": result.fun,
+        "params": result.x,
+        "errors": np.sqrt(np.maximum(np.diag(covariance), 0.)),
+        "covariance": covariance,
+        "prefit": propagate_yields(model, prefit_params, prefit_covariance),
+        "postfit": propagate_yields(model, result.x, covariance),
+    }
+
+def load_model(yaml_spec, event_catname, filename, mcstats=True):
+    categories = list(yaml_spec["categories"].keys())
+    shape_names = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc]["mode"] in ["factor", "file"]]
+    lnn_names = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc]["mode"] == "lnN"]
+    for unc in yaml_spec["uncertainties"].keys():
+        if unc not in shape_names + lnn_names:
+            print(f"Warning: uncertainty {unc} with mode {yaml_spec['uncertainties'][unc]['mode']} is not supported by the local fit, ignoring")
+
+    fileobj = pyr.TFile(filename, "READ")
+    data = np.stack([hist_to_numpy(fileobj.Get(f"data_{event_catname}_{channel}"))[0] for channel in CHANNELS])
+    nominal = np.zeros((2, len(categories), data.shape[1]))
+    nominal_error = np.zeros(nominal.shape)
+    shape_up = np.zeros((len(shape_names),) + nominal.shape)
+    shape_down = np.zeros(shape_up.shape)
+    template_hists = {}
+    for c, channel in enumerate(CHANNELS):
+        for k, category in enumerate(categories):
+            hist = fileobj.Get(f"{category}_{event_catname}_{channel}_nominal")
+            nominal[c, k], nominal_error[c, k] = hist_to_numpy(hist)
+            for s, unc in enumerate(shape_names):
+                # As in the datacard, a shape uncertainty with a category only applies to that tagging category
+                if yaml_spec["uncertainties"][unc].get("category", category) != category:
+                    shape_up[s, c, k] = shape_down[s, c, k] = nominal[c, k]
+                    continue
+                shape_up[s, c, k] = hist_to_numpy(fileobj.Get(f"{category}_{event_catname}_{channel}_{unc}Up"))[0]
+                shape_down[s, c, k] = hist_to_numpy(fileobj.Get(f"{category}_{event_catname}_{channel}_{unc}Down"))[0]
+        template_hists[channel] = fileobj.Get(f"data_{event_catname}_{channel}").Clone(f"template_{event_catname}_{channel}")
+        template_hists[channel].SetDirectory(pyr.gROOT)
+    fileobj.Close()
+
+    shape_scale = np.zeros((len(shape_names), len(categories)))
+    for s, unc in enumerate(shape_names):
+        unc_config = yaml_spec["uncertainties"][unc]
+        size = float(unc_config["size"]) if "size" in unc_config else 1.
+        for k, category in enumerate(categories):
+            if "category" not in unc_config.keys() or unc_config["category"] == category:
+                shape_scale[s, k] = size
+
+    lnn_logkappa = np.zeros((len(lnn_names), len(categories)))
+    lnn_logkappa_down = np.zeros(lnn_logkappa.shape)
+    for l, unc in enumerate(lnn_names):
+        unc_config = yaml_spec["uncertainties"][unc]
+        logkappa_down, logkappa_up = lnn_log_kappas(unc_config["size"]) if "size" in unc_config else (0., 0.)
+        for k, category in enumerate(categories):
+            if "category" not in unc_config.keys() or unc_config["category"] == category:
+                lnn_logkappa[l, k] = logkappa_up
+                lnn_logkappa_down[l, k] = logkappa_down
+
+    # Same normalisation factor as norm_match_mc_data in the datacard, frozen in the fit
+    norm = data.sum() / nominal.sum()
+
+    model = TemplateFitModel(
+        categories, nominal, nominal_error,
+        shape_names, shape_up, shape_down,
+        lnn_names, lnn_logkappa,
+        data, norm, mcstats=mcstats,
+        shape_scale=shape_scale, lnn_logkappa_down=lnn_logkappa_down
+    )
+    return model, template_hists
+
+def array_to_hist(template, name, content, error):
+    hist = template.Clone(name)
+    hist.Reset("ICES")
+    for i in range(len(content)):
+        hist.SetBinContent(i+1, content[i])
+        hist.SetBinError(i+1, error[i])
+    return hist
+
+def data_to_graph(template, name, content):
+    hist = array_to_hist(template, f"{name}_poisson", content, np.sqrt(content))
+    hist.SetBinErrorOption(pyr.TH1.kPoisson)
+    graph = pyr.TGraphAsymmErrors(len(content))
+    graph.SetName(name)
+    for i in range(len(content)):
+        graph.SetPoint(i, hist.GetBinCenter(i+1), content[i])
+        graph.SetPointError(i, 0.5*hist.GetBinWidth(i+1), 0.5*hist.GetBinWidth(i+1), hist.GetBinErrorLow(i+1), hist.GetBinErrorUp(i+1))
+    return graph
+
+def save_fit_diagnostics(model, result, template_hists, filename):
+    # Same directory layout as the FitDiagnostics output of HiggsCombine, as read by plot_histograms.py
+    savefile = pyr.TFile(filename, "RECREATE")
+    for dirname, key in [("shapes_prefit", "prefit"), ("shapes_fit_s", "postfit")]:
+        per_category, per_category_error, total, total_error = result[key]
+        shapes_dir = savefile.mkdir(dirname)
+        for c, channel in enumerate(CHANNELS):
+            channel_dir = shapes_dir.mkdir(channel)
+            for k, category in enumerate(model.categories):
+                channel_dir.WriteTObject(array_to_hist(template_hists[channel], category, per_category[c, k], per_category_error[c, k]), category)
+            channel_dir.WriteTObject(array_to_hist(template_hists[channel], "total", total[c], total_error[c]), "total")
+            channel_dir.WriteTObject(data_to_graph(template_hists[channel], "data", model.data[c]), "data")
+    savefile.Close()
+
+    np.savez(
+        filename.replace(".root", ".npz"),
+        param_names=np.array(model.param_names),
+        params=result["params"],
+        errors=result["errors"],
+        covariance=result["covariance"],
+        categories=np.array(model.categories),
+        data=model.data,
+        prefit=result["prefit"][0],
+        prefit_error=result["prefit"][1],
+        postfit=result["postfit"][0],
+        postfit_error=result["postfit"][1],
+        nll=result["nll"],
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, same as input for make_histograms.py")
+    parser.add_argument("--outdir", help="Output directory for fitDiagnostics files (default: analysisname from the spec)", default=None)
+    parser.add_argument("--no-mcstats", help="Do not include MC statistical uncertainties (autoMCStats) in the fit", action="store_true")
+    parser.add_argument("-j", "--jobs", help="Number of event categories fitted concurrently (default: number of CPUs)", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.yamlpath, "r") as yamlfile:
+        yaml_spec = yaml.safe_load(yamlfile)
+
+    analysis_name = "."
+    if "analysisname" in yaml_spec.keys(): analysis_name = yaml_spec["analysisname"]
+    outdir = args.outdir if args.outdir is not None else analysis_name
+    os.makedirs(outdir, exist_ok=True)
+
+    event_catnames = [e["name"] for e in yaml_spec["distribution"]["event_categories"]]
+    models = {}
+    template_hists = {}
+    for event_catname in event_catnames:
+        try:
+            models[event_catname], template_hists[event_catname] = load_model(
+                yaml_spec, event_catname, f"{analysis_name}/{event_catname}.root", mcstats=not args.no_mcstats
+            )
+        except ValueError as error:
+            parser.error(str(error))
+
+    # Workers are spawned, not forked, since ROOT is already loaded here
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = dict(zip(event_catnames, executor.map(fit_event_category, [models[name] for name in event_catnames])))
+
+    for event_catname in event_catnames:
+        model = models[event_catname]
+        result = results[event_catname]
+        print("=====================")
+        print(f"Event category: {event_catname}")
+        if not result["success"]: print(f"Warning: fit did not converge ({result['message']})")
+        for name, value, error in zip(model.param_names, result["params"], result["errors"]):
+            print(f"{name}\t{value:.4f} +/- {error:.4f}")
+        save_fit_diagnostics(model, result, template_hists[event_catname], f"{outdir}/fitDiagnostics{event_catname}.root")
+
+    print("===========================")
+    print("All done! :-)")
@@ -0,0 +1,160 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import ROOT as pyr
+import yaml
+
+YIELDS_FILENAME = "yields.yaml"
+
+def escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+def yields_summary(analysis_obj_collection):
+    # Integrals of the data and summed nominal MC histograms, after empty bins are set to 0.01 in save_histograms
+    summary = {}
+    for key, analysis_obj in analysis_obj_collection.items():
+        summary[key] = {}
+        for passing in ["pass", "fail"]:
+            summary[key][f"data_{passing}"] = analysis_obj.data_hist[passing].Integral(1, analysis_obj.data_hist[passing].GetNbinsX())
+            summary[key][f"mc_{passing}"] = sum(
+                analysis_obj.nom_hist[category][passing].Integral(1, analysis_obj.nom_hist[category][passing].GetNbinsX())
+                for category in analysis_obj.categories
+            )
+    return summary
+
+def yields_from_root(analysis_name, keys, categories):
+    # Same as yields_summary, from the output ROOT files of make_histograms.py, for outputs made without a yields file
+    summary = {}
+    for key in keys:
+        rootfile = pyr.TFile.Open(f"{analysis_name}/{key}.root", "READ")
+        summary[key] = {}
+        for passing in ["pass", "fail"]:
+            hist_data = rootfile.Get(f"data_{key}_{passing}")
+            summary[key][f"data_{passing}"] = hist_data.Integral(1, hist_data.GetNbinsX())
+            summary[key][f"mc_{passing}"] = 0.
+            for category in categories:
+                hist_mc = rootfile.Get(f"{category}_{key}_{passing}_nominal")
+                summary[key][f"mc_{passing}"] += hist_mc.Integral(1, hist_mc.GetNbinsX())
+        rootfile.Close()
+    return summary
+
+def write_atomic(filename, text):
+    # Writes to a temporary file in the same directory first, so that readers never see a partially written file
+    tmpname = os.path.join(os.path.dirname(filename), f".{os.path.basename(filename)}.{os.getpid()}.tmp")
+    with open(tmpname, "w") as tmpfile:
+        tmpfile.write(text)
+    os.replace(tmpname, filename)
+
+def save_yields(summary, analysis_name):
+    write_atomic(f"{analysis_name}/{YIELDS_FILENAME}", yaml.safe_dump({key: {name: float(value) for name, value in yields.items()} for key, yields in summary.items()}, sort_keys=False))
+
+def load_yields(analysis_name, keys, categories):
+    yields_path = f"{analysis_name}/{YIELDS_FILENAME}"
+    if os.path.exists(yields_path):
+        with open(yields_path, "r") as yieldsfile:
+            summary = yaml.safe_load(yieldsfile)
+        if all(key in summary.keys() for key in keys): return summary
+    print(f"Debug: {yields_path} not found or incomplete, reading yields from output ROOT files")
+    return yields_from_root(analysis_name, keys, categories)
+
+def compile_datacard_template(yaml_spec, categories):
+    """
+    Builds the datacard once per spec as a str.format template.
+    Only the event category name, the observation counts and norm_match_mc_data differ between event categories.
+    """
+    categories = list(categories)
+    number_of_categories = len(categories)
+    combine_lines = []
+
+    combine_lines.append("imax 2 (two channels, pass and fail)\n")
+    combine_lines.append(escape_braces(f"jmax {number_of_categories-1} ({number_of_categories} categories minus 1)\n"))
+    combine_lines.append("kmax * (automatic number of nuisance parameters)\n")
+    combine_lines.append("----------\n")
+
+    combine_lines.append("shapes data_obs pass {key}.root data_{key}_pass\n")
+    combine_lines.append("shapes * pass {key}.root $PROCESS_{key}_pass_nominal $PROCESS_{key}_pass_$SYSTEMATIC\n")
+    combine_lines.append("shapes data_obs fail {key}.root data_{key}_fail\n")
+    combine_lines.append("shapes * fail {key}.root $PROCESS_{key}_fail_nominal $PROCESS_{key}_fail_$SYSTEMATIC\n")
+    combine_lines.append("----------\n")
+
+    combine_lines.append("bin\tpass\tfail\n")
+    combine_lines.append("observation\t{data_pass:.0f}\t{data_fail:.0f}\n")
+    combine_lines.append("----------\n")
+
+    combine_lines.append("# automatic counting of MC events\n")
+    combine_lines.append("bin\t" + "pass\t"*number_of_categories + "fail\t"*number_of_categories + '\n')
+    combine_lines.append(escape_braces("process\t"+'\t'.join(categories*2) + '\n'))
+    combine_lines.append("process\t"+'\t'.join(list(map(str, range(number_of_categories)))*2) + '\n')
+    combine_lines.append("rate\t"+"-1\t"*number_of_categories*2 + '\n')
+    combine_lines.append("----------\n")
+
+    for unc in yaml_spec["uncertainties"].keys():
+        unc_line = unc + '\t'
+        unc_size = ""
+        unc_size_number = yaml_spec["uncertainties"][unc]["size"] if "size" in yaml_spec["uncertainties"][unc] else 1
+        if yaml_spec["uncertainties"][unc]["mode"] in ["factor", "file"]:
+            unc_line += "shape\t"
+        else:
+            unc_line += yaml_spec["uncertainties"][unc]["mode"] + '\t'
+        if "category" in yaml_spec["uncertainties"][unc].keys():
+            for category in categories:
+                if category == yaml_spec["uncertainties"][unc]["category"]: unc_size += f"{unc_size_number}\t"
+                else: unc_size += "-\t"
+            unc_size = unc_size + unc_size
+        else:
+            unc_size = '\t'.join([f"{unc_size_number}"]*number_of_categories*2)
+        combine_lines.append(escape_braces(unc_line+unc_size+'\n'))
+    combine_lines.append("# normalisation factor to match MC and data\n")
+    combine_lines.append("# freezes automatically\n")
+    combine_lines.append("norm_match_mc_data rateParam * * {norm_match_mc_to_data:.6f}\n")
+    combine_lines.append("nuisance edit freeze norm_match_mc_data\n")
+    combine_lines.append("\n")
+    combine_lines.append("# activating autoMCStats\n")
+    combine_lines.append("* autoMCStats 0\n")
+    return "".join(combine_lines)
+
+def render_datacard(template, key, yields):
+    norm_match_mc_to_data = (yields["data_pass"] + yields["data_fail"]) / (yields["mc_pass"] + yields["mc_fail"])
+    return template.format(key=key, data_pass=yields["data_pass"], data_fail=yields["data_fail"], norm_match_mc_to_data=norm_match_mc_to_data)
+
+def write_datacard(template, analysis_name, key, yields):
+    write_atomic(f"{analysis_name}/{key}.txt", render_datacard(template, key, yields))
+    return f"{key}.txt"
+
+def combine_script(keys, categories):
+    script_lines = []
+    script_lines.append("#!/bin/bash\n")
+    script_lines.append("# Converting datacards to workspace file for portability :-)\n")
+    for key in keys:
+        script_lines.append(f"text2workspace.py -m 125 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe {key}.txt -o workspace_{key}.root --PO=categories={','.join(categories)}\n")
+    return "".join(script_lines)
+
+def make_datacards(yaml_spec, summary=None, max_workers=None):
+    """
+    Writes one datacard per event category and combine_script.sh from the yields summary, without touching any histogram.
+    summary: {event category: {data_pass, data_fail, mc_pass, mc_fail}}, loaded from the analysis directory if None.
+    """
+    analysis_name = yaml_spec.get("analysisname", ".")
+    categories = list(yaml_spec["categories"].keys())
+    keys = [e["name"] for e in yaml_spec["distribution"]["event_categories"]]
+    if summary is None: summary = load_yields(analysis_name, keys, categories)
+
+    template = compile_datacard_template(yaml_spec, categories)
+    # Threads rather than processes, so that no process is forked with ROOT loaded and input files open
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for filename in executor.map(write_datacard, [template]*len(keys), [analysis_name]*len(keys), keys, [summary[key] for key in keys]):
+            print(f"Printing datacard {filename}")
+
+    print(f"Printing combine script file combine_script.sh")
+    write_atomic(f"{analysis_name}/combine_script.sh", combine_script(keys, categories))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, same as input for make_histograms.py")
+    parser.add_argument("-j", "--jobs", help="Number of datacards written concurrently (default: chosen by ThreadPoolExecutor)", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.yamlpath, "r") as yamlfile:
+        yaml_spec = yaml.safe_load(yamlfile)
+
+    make_datacards(yaml_spec, max_workers=args.jobs)
@@ -1,9 +1,14 @@
 from array import array
+from collections import OrderedDict
 import os
+import zlib
 import numpy as np
 import ROOT as pyr
 import yaml
 import argparse
+from validate_spec import validate_spec, print_report, tagger_cuts
+from make_datacards import yields_summary, save_yields, make_datacards
+from deduplicate import find_duplicates, print_duplicate_report, save_duplicate_report, DEFAULT_BRANCHES as DEFAULT_DEDUP_BRANCHES
 
 PYROOT_DEFAULT_DIR = pyr.gDirectory.pwd()
 
@@ -40,8 +45,9 @@ class AnalysisHistogram(object):
     def add_data_hist(self, hist, isPass=True):
         self.data_hist["pass" if isPass else "fail"] = hist
     
-    def save_histograms(self, filename):
-        self.check_zero_bins()
+    def save_histograms(self, filename, floor_zero_bins=True):
+        # floor_zero_bins=False writes the histograms as filled, e.g. to compare them before check_zero_bins
+        if floor_zero_bins: self.check_zero_bins()
         savefile = pyr.TFile(filename, "RECREATE")
         for category in self.categories:
             self.nom_hist[category]["pass"].Write()
@@ -69,12 +75,148 @@ class AnalysisHistogram(object):
                                 self.unc_hist[category][unc][unctype][passing].SetBinContent(i, 0.01)
                                 self.unc_hist[category][unc][unctype][passing].SetBinError(i, 0.01)
 
-def extract_histogram(filename, treename, var, cut, weight, histname, xbins, xmin, xmax):
-    fileobj = pyr.TFile(filename, "READ")
+class HistogramCache(object):
+    """
+    Keeps input files open and filled histograms in memory between runs, used by serve.py.
+    Histograms are keyed by everything that goes into TTree.Project and by the modification time of the input file,
+    so any change in the spec or in the file itself triggers a refill of the affected histograms only.
+    With max_histograms set, the least recently used histograms (and their bootstrap replicas) are dropped beyond that number.
+    """
+    def __init__(self, max_histograms=None):
+        self.max_histograms = max_histograms
+        self.hists = OrderedDict()
+        self.replicas = {}
+        self.duplicates = {}
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+
+    def file_signature(self, filename):
+        return os.path.getmtime(filename) if os.path.exists(filename) else None
+
+    def get_file(self, filename):
+        signature = self.file_signature(filename)
+        if filename in self.files.keys() and self.files[filename][0] != signature: self.forget(filename)
+        if filename not in self.files.keys():
+            self.files[filename] = (signature, pyr.TFile(filename, "READ"))
+        return self.files[filename][1]
+
+    def forget(self, filename):
+        if filename in self.files.keys():
+            self.files[filename][1].Close()
+            del self.files[filename]
+        for key in [key for key in self.hists.keys() if key[0] == filename]: del self.hists[key]
+        for key in [key for key in self.replicas.keys() if key[0] == filename]: del self.replicas[key]
+
+    def key(self, filename, treename, var, cut, weight, xbins, xmin, xmax, exclude=None):
+        exclude_signature = None if exclude is None else (len(exclude), zlib.crc32(exclude.tobytes()))
+        return (filename, self.file_signature(filename), treename, var, cut, weight, xbins, xmin, xmax, exclude_signature)
+
+    def get(self, cache_key, histname):
+        if cache_key not in self.hists.keys():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.hists.move_to_end(cache_key)
+        hist = self.hists[cache_key].Clone(histname)
+        hist.SetTitle(histname)
+        hist.SetDirectory(pyr.gROOT)
+        return hist
+
+    def put(self, cache_key, hist):
+        cached_hist = hist.Clone(f"cached_{hist.GetName()}")
+        cached_hist.SetDirectory(0)
+        self.hists[cache_key] = cached_hist
+        self.hists.move_to_end(cache_key)
+        if self.max_histograms is None: return
+        while len(self.hists) > self.max_histograms:
+            evicted_key, _ = self.hists.popitem(last=False)
+            self.replicas.pop(evicted_key, None)
+
+    def get_replicas(self, cache_key, bootstrap):
+        return self.replicas.get(cache_key, {}).get(bootstrap)
+
+    def put_replicas(self, cache_key, bootstrap, replica):
+        # Only kept along with the histogram itself, so that eviction drops both
+        if cache_key in self.hists.keys(): self.replicas.setdefault(cache_key, {})[bootstrap] = replica
+
+# Set to a HistogramCache object to reuse histograms and open files between runs
+HISTOGRAM_CACHE = None
+
+DEDUP_CODE = """
+namespace topsf {
+std::vector<std::vector<std::int64_t>> dedup_excluded;
+int dedup_register(const std::int64_t* entries, std::int64_t nentries) {
+    dedup_excluded.emplace_back(entries, entries + nentries);
+    return dedup_excluded.size() - 1;
+}
+void dedup_clear() {
+    dedup_excluded.clear();
+    dedup_excluded.shrink_to_fit();
+}
+bool dedup_keep(int id, ULong64_t entry) {
+    const auto& excluded = dedup_excluded[id];
+    return !std::binary_search(excluded.begin(), excluded.end(), (std::int64_t) entry);
+}
+void fill_kept_entries(TEntryList* entrylist, TTree* tree, const std::int64_t* excluded, std::int64_t nexcluded) {
+    std::int64_t j = 0;
+    for (Long64_t i = 0; i < tree->GetEntries(); i++) {
+        while (j < nexcluded && excluded[j] < i) j++;
+        if (j < nexcluded && excluded[j] == i) continue;
+        entrylist->Enter(i);
+    }
+}
+}
+"""
+DEDUP_DECLARED = False
+# (filename, exclude signature) -> id of the excluded entries registered in C++ for the rdf engine
+DEDUP_IDS = {}
+
+def declare_dedup_code():
+    global DEDUP_DECLARED
+    if DEDUP_DECLARED: return
+    pyr.gInterpreter.Declare(DEDUP_CODE)
+    DEDUP_DECLARED = True
+
+def dedup_id(filename, exclude):
+    declare_dedup_code()
+    key = (filename, len(exclude), zlib.crc32(exclude.tobytes()))
+    if key not in DEDUP_IDS.keys(): DEDUP_IDS[key] = pyr.topsf.dedup_register(exclude, len(exclude))
+    return DEDUP_IDS[key]
+
+def clear_dedup_registry():
+    # Registered entries are only needed while the event loops of one run are booked, see make_histograms_multi
+    DEDUP_IDS.clear()
+    if DEDUP_DECLARED: pyr.topsf.dedup_clear()
+
+def kept_entry_list(treeobj, exclude):
+    # TEntryList of all entries of treeobj not in exclude, owned by Python and deleted with the returned object
+    declare_dedup_code()
+    entrylist = pyr.TEntryList(treeobj)
+    entrylist.SetDirectory(pyr.nullptr)
+    pyr.topsf.fill_kept_entries(entrylist, treeobj, exclude, len(exclude))
+    return entrylist
+
+def extract_histogram(filename, treename, var, cut, weight, histname, xbins, xmin, xmax, exclude=None, entrylist=None):
+    # exclude: sorted array of entries to skip, e.g. duplicate data events
+    # entrylist: kept_entry_list of exclude, to share it between histograms of the same file
+    if HISTOGRAM_CACHE is not None:
+        cache_key = HISTOGRAM_CACHE.key(filename, treename, var, cut, weight, xbins, xmin, xmax, exclude)
+        hist = HISTOGRAM_CACHE.get(cache_key, histname)
+        if hist is not None: return hist
+        fileobj = HISTOGRAM_CACHE.get_file(filename)
+        fileobj.cd()
+    else:
+        fileobj = pyr.TFile(filename, "READ")
     treeobj = fileobj.Get(treename)
     hist = pyr.TH1F(histname, histname, xbins, xmin, xmax)
     print(f"({cut})*({weight})")
+    if exclude is not None and len(exclude) > 0:
+        if entrylist is None: entrylist = kept_entry_list(treeobj, exclude)
+        treeobj.SetEntryList(entrylist)
     project_out = treeobj.Project(histname, var, f"({cut})*({weight})", "e")
+    if exclude is not None and len(exclude) > 0:
+        treeobj.SetEntryList(pyr.nullptr)
     print(project_out)
     #integral = hist.GetBinContent(xbins) + hist.GetBinContent(xbins+1)
     #error = (hist.GetBinError(xbins)**2 + hist.GetBinError(xbins+1)**2)**0.5
@@ -84,11 +226,292 @@ def extract_histogram(filename, treename, var, cut, weight, histname, xbins, xmi
     print(hist)
     print_histogram(hist)
     hist.SetDirectory(pyr.gROOT)
-    fileobj.Close()
+    if HISTOGRAM_CACHE is not None:
+        HISTOGRAM_CACHE.put(cache_key, hist)
+        pyr.gROOT.cd()
+    else:
+        fileobj.Close()
     print(hist)
     print_histogram(hist)
     return hist
 
+FORMULA_CODE = """
+#include "TTreeFormula.h"
+#include "TTreeFormulaManager.h"
+namespace topsf {
+// Fills every histogram in one pass over the tree.
+// Each histogram is filled as TTree::Project(hist, var, selection) would, with the same TTreeFormula evaluation,
+// including the handling of array expressions, while the branches are only read once per entry.
+void fill_formulas(TTree* tree, const std::vector<TH1*>& hists, const std::vector<std::string>& vars, const std::vector<std::string>& selections,
+                   const std::int64_t* excluded, std::int64_t nexcluded) {
+    const size_t nhists = hists.size();
+    std::vector<std::unique_ptr<TTreeFormula>> var_formulas, selection_formulas;
+    std::vector<TTreeFormulaManager*> managers;
+    for (size_t h = 0; h < nhists; h++) {
+        var_formulas.emplace_back(new TTreeFormula(Form("topsf_var_%zu", h), vars[h].c_str(), tree));
+        selection_formulas.emplace_back(new TTreeFormula(Form("topsf_selection_%zu", h), selections[h].c_str(), tree));
+        if (var_formulas[h]->GetNdim() == 0) throw std::runtime_error("cannot compile " + vars[h]);
+        if (selection_formulas[h]->GetNdim() == 0) throw std::runtime_error("cannot compile " + selections[h]);
+        // Owned by the formulas, deleted together with the last of them
+        auto manager = new TTreeFormulaManager();
+        manager->Add(var_formulas[h].get());
+        manager->Add(selection_formulas[h].get());
+        manager->Sync();
+        managers.push_back(manager);
+    }
+    const double tree_weight = tree->GetWeight();
+    std::int64_t j = 0;
+    for (Long64_t entry = 0; entry < tree->GetEntries(); entry++) {
+        while (j < nexcluded && excluded[j] < entry) j++;
+        if (j < nexcluded && excluded[j] == entry) continue;
+        if (tree->LoadTree(entry) < 0) break;
+        for (size_t h = 0; h < nhists; h++) {
+            TTreeFormula* var = var_formulas[h].get();
+            TTreeFormula* selection = selection_formulas[h].get();
+            const int multiplicity = managers[h]->GetMultiplicity();
+            if (multiplicity < 1) {
+                if (multiplicity == -1 && managers[h]->GetNdata() <= 0) continue;
+                const double w = tree_weight * selection->EvalInstance(0);
+                if (w != 0) hists[h]->Fill(var->EvalInstance(0), w);
+                continue;
+            }
+            // Same as TSelectorDraw::ProcessFillMultiple
+            const int ndata = managers[h]->GetNdata();
+            const bool selection_multiple = selection->GetMultiplicity() != 0;
+            const bool var_multiple = var->GetMultiplicity() != 0;
+            double w0 = 0, x0 = 0;
+            for (int i = 0; i < ndata; i++) {
+                double w = w0;
+                if (i == 0) {
+                    w = w0 = tree_weight * selection->EvalInstance(0);
+                    if (w == 0 && !selection_multiple) break;
+                } else if (selection_multiple) {
+                    w = tree_weight * selection->EvalInstance(i);
+                }
+                if (w == 0) continue;
+                double x = x0;
+                if (i == 0) x = x0 = var->EvalInstance(0);
+                else if (var_multiple) x = var->EvalInstance(i);
+                hists[h]->Fill(x, w);
+            }
+        }
+    }
+}
+}
+"""
+FORMULA_DECLARED = False
+
+def declare_formula_code():
+    global FORMULA_DECLARED
+    if FORMULA_DECLARED: return
+    pyr.gInterpreter.Declare(FORMULA_CODE)
+    FORMULA_DECLARED = True
+
+def extract_histograms_formula(filename, treename, bookings, exclude=None):
+    # Fills all histograms booked for one file in a single pass over the tree, with TTreeFormula as in TTree.Project
+    # exclude: sorted array of entries to skip, e.g. duplicate data events
+    declare_formula_code()
+    if HISTOGRAM_CACHE is not None:
+        fileobj = HISTOGRAM_CACHE.get_file(filename)
+    else:
+        fileobj = pyr.TFile(filename, "READ")
+    treeobj = fileobj.Get(treename)
+    pyr.gROOT.cd()
+
+    hists = []
+    hist_vector = pyr.std.vector["TH1*"]()
+    var_vector = pyr.std.vector["std::string"]()
+    selection_vector = pyr.std.vector["std::string"]()
+    for booking in bookings:
+        # Same histogram type as TTree.Project output in extract_histogram
+        hist = pyr.TH1F(booking["histname"], booking["histname"], booking["xbins"], booking["xmin"], booking["xmax"])
+        hist.Sumw2()
+        hist.SetDirectory(pyr.gROOT)
+        hists.append(hist)
+        hist_vector.push_back(hist)
+        var_vector.push_back(booking["var"])
+        selection_vector.push_back(f"({booking['cut']})*({booking['weight']})")
+    if exclude is None: exclude = np.zeros(0, dtype=np.int64)
+    pyr.topsf.fill_formulas(treeobj, hist_vector, var_vector, selection_vector, exclude, len(exclude))
+
+    if HISTOGRAM_CACHE is None: fileobj.Close()
+    for hist in hists:
+        print(hist)
+        print_histogram(hist)
+    return hists, [None]*len(hists)
+
+BOOTSTRAP_CODE = """
+namespace topsf {
+// SplitMix64, used as a counter-based random number generator
+ULong64_t splitmix64(ULong64_t x) {
+    x += 0x9e3779b97f4a7c15ULL;
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    x = (x ^ (x >> 27)) * 0x94d049bb133111ebULL;
+    return x ^ (x >> 31);
+}
+// Poisson(1) weights of one entry for all replicas, depending only on (seed, entry, replica)
+ROOT::RVec<double> bootstrap_weights(ULong64_t seed, ULong64_t entry, unsigned int nreplicas, double weight) {
+    ROOT::RVec<double> weights(nreplicas);
+    const ULong64_t entry_seed = splitmix64(seed ^ splitmix64(entry));
+    for (unsigned int i = 0; i < nreplicas; i++) {
+        const double u = (splitmix64(entry_seed + i) >> 11) * 0x1.0p-53;
+        int k = 0;
+        double p = 0.36787944117144233;
+        double cdf = p;
+        while (u > cdf && k < 30) { k++; p /= k; cdf += p; }
+        weights[i] = weight * k;
+    }
+    return weights;
+}
+ROOT::RVec<double> bootstrap_values(double value, unsigned int nreplicas) { return ROOT::RVec<double>(nreplicas, value); }
+ROOT::RVec<double> bootstrap_indices(unsigned int nreplicas) {
+    ROOT::RVec<double> indices(nreplicas);
+    for (unsigned int i = 0; i < nreplicas; i++) indices[i] = i;
+    return indices;
+}
+}
+"""
+BOOTSTRAP_DECLARED = False
+
+def bootstrap_file_seed(filename, seed):
+    # Depends only on the user seed and the file path, so that replicas do not depend on the order of files
+    return ((seed & 0xffffffff) << 32) | zlib.crc32(filename.encode())
+
+def hist2d_to_replicas(hist):
+    # (replicas x bins) array from the TH2D filled in extract_histograms_rdf, without under/overflow
+    nbins = hist.GetNbinsX()
+    nreplicas = hist.GetNbinsY()
+    buffer = hist.GetArray()
+    buffer.reshape((hist.GetNcells(),))
+    cells = np.array(buffer, dtype=np.float64)
+    return cells.reshape(nreplicas+2, nbins+2)[1:-1, 1:-1].copy()
+
+def extract_histograms_rdf(filename, treename, bookings, bootstrap=None, exclude=None):
+    # Fills all histograms booked for one file in a single event loop with RDataFrame
+    # bootstrap: (number of replicas, seed), also fills replicas for bookings with "bootstrap" set
+    # exclude: sorted array of entries to skip, e.g. duplicate data events
+    global BOOTSTRAP_DECLARED
+    if HISTOGRAM_CACHE is not None:
+        rdf = pyr.RDataFrame(HISTOGRAM_CACHE.get_file(filename).Get(treename))
+    else:
+        rdf = pyr.RDataFrame(treename, filename)
+    if exclude is not None and len(exclude) > 0:
+        rdf = rdf.Filter(f"topsf::dedup_keep({dedup_id(filename, exclude)}, rdfentry_)")
+
+    columns = {}
+    for booking in bookings:
+        for expression in [booking["var"], booking["weight"]]:
+            if expression not in columns.keys(): columns[expression] = f"topsf_column_{len(columns)}"
+    for expression, column in columns.items(): rdf = rdf.Define(column, expression)
+
+    bootstrap_columns = {}
+    if bootstrap is not None and any(booking.get("bootstrap", False) for booking in bookings):
+        nreplicas, seed = bootstrap
+        if not BOOTSTRAP_DECLARED:
+            pyr.gInterpreter.Declare(BOOTSTRAP_CODE)
+            BOOTSTRAP_DECLARED = True
+        file_seed = bootstrap_file_seed(filename, seed)
+        # rdfentry_ is the entry number in the tree, as long as implicit multithreading is off
+        rdf = rdf.Define("topsf_bootstrap_index", f"topsf::bootstrap_indices({nreplicas})")
+        for booking in bookings:
+            if not booking.get("bootstrap", False): continue
+            for expression in [booking["var"], booking["weight"]]:
+                if expression in bootstrap_columns.keys(): continue
+                bootstrap_columns[expression] = columns[expression] + "_bootstrap"
+                if expression == booking["var"]:
+                    rdf = rdf.Define(bootstrap_columns[expression], f"topsf::bootstrap_values({columns[expression]}, {nreplicas})")
+                else:
+                    rdf = rdf.Define(bootstrap_columns[expression], f"topsf::bootstrap_weights({file_seed}ULL, rdfentry_, {nreplicas}, {columns[expression]})")
+
+    filtered = {}
+    results = []
+    replica_results = []
+    for booking in bookings:
+        if booking["cut"] not in filtered.keys(): filtered[booking["cut"]] = rdf.Filter(booking["cut"])
+        model = pyr.RDF.TH1DModel(booking["histname"], booking["histname"], booking["xbins"], booking["xmin"], booking["xmax"])
+        results.append(filtered[booking["cut"]].Histo1D(model, columns[booking["var"]], columns[booking["weight"]]))
+        if bootstrap_columns and booking.get("bootstrap", False):
+            model = pyr.RDF.TH2DModel(
+                booking["histname"]+"_bootstrap", booking["histname"]+"_bootstrap",
+                booking["xbins"], booking["xmin"], booking["xmax"], bootstrap[0], 0, bootstrap[0]
+            )
+            replica_results.append(filtered[booking["cut"]].Histo2D(
+                model, bootstrap_columns[booking["var"]], "topsf_bootstrap_index", bootstrap_columns[booking["weight"]]
+            ))
+        else:
+            replica_results.append(None)
+
+    hists = []
+    replicas = []
+    for booking, result, replica_result in zip(bookings, results, replica_results):
+        # Same histogram type as TTree.Project output in extract_histogram
+        hist = pyr.TH1F(booking["histname"], booking["histname"], booking["xbins"], booking["xmin"], booking["xmax"])
+        hist.Sumw2()
+        hist.Add(result.GetValue())
+        hist.SetDirectory(pyr.gROOT)
+        print(hist)
+        print_histogram(hist)
+        hists.append(hist)
+        replicas.append(None if replica_result is None else hist2d_to_replicas(replica_result.GetValue()))
+    return hists, replicas
+
+def extract_file_histograms(filename, treename, bookings, engine="formula", bootstrap=None, replicas=None, exclude=None):
+    """
+    Fills all histograms booked for one input file, returns them in the same order as bookings.
+    Each booking is a dictionary with keys histname, var, cut, weight, xbins, xmin, xmax, and optionally bootstrap.
+    engine "formula" fills all of them in one pass over the file, evaluating expressions with TTreeFormula as TTree.Project does,
+    engine "project" fills each histogram with its own TTree.Project call,
+    engine "rdf" fills all of them in one pass over the file with RDataFrame.
+    With bootstrap = (number of replicas, seed), bootstrap replicas of bookings with bootstrap set are stored in replicas[histname].
+    Entries in exclude (sorted array) are skipped for all bookings.
+    """
+    print(f"Debug: filling {len(bookings)} histograms from {filename}")
+    if engine == "project":
+        if bootstrap is not None: raise ValueError("Bootstrap replicas are only supported by the rdf engine")
+        entrylist = None
+        if exclude is not None and len(exclude) > 0:
+            # One entry list per file, shared by all its histograms
+            fileobj = HISTOGRAM_CACHE.get_file(filename) if HISTOGRAM_CACHE is not None else pyr.TFile(filename, "READ")
+            entrylist = kept_entry_list(fileobj.Get(treename), exclude)
+            if HISTOGRAM_CACHE is None: fileobj.Close()
+        hists = [extract_histogram(
+            filename=filename, treename=treename, var=b["var"], cut=b["cut"], weight=b["weight"],
+            histname=b["histname"], xbins=b["xbins"], xmin=b["xmin"], xmax=b["xmax"], exclude=exclude, entrylist=entrylist
+        ) for b in bookings]
+        del entrylist
+        return hists
+    if engine not in ["formula", "rdf"]: raise ValueError(f"Unknown engine {engine}, must be formula, project or rdf")
+    if engine == "formula" and bootstrap is not None: raise ValueError("Bootstrap replicas are only supported by the rdf engine")
+
+    def cache_key(b):
+        return HISTOGRAM_CACHE.key(filename, treename, b["var"], b["cut"], b["weight"], b["xbins"], b["xmin"], b["xmax"], exclude)
+    def needs_replicas(b):
+        return bootstrap is not None and b.get("bootstrap", False)
+
+    hists = [None]*len(bookings)
+    pending = []
+    for i, b in enumerate(bookings):
+        if HISTOGRAM_CACHE is not None:
+            if needs_replicas(b) and HISTOGRAM_CACHE.get_replicas(cache_key(b), bootstrap) is None:
+                HISTOGRAM_CACHE.misses += 1
+                pending.append(i)
+                continue
+            hists[i] = HISTOGRAM_CACHE.get(cache_key(b), b["histname"])
+            if hists[i] is not None and needs_replicas(b): replicas[b["histname"]] = HISTOGRAM_CACHE.get_replicas(cache_key(b), bootstrap)
+        if hists[i] is None: pending.append(i)
+    if pending:
+        if engine == "rdf":
+            filled, filled_replicas = extract_histograms_rdf(filename, treename, [bookings[i] for i in pending], bootstrap=bootstrap, exclude=exclude)
+        else:
+            filled, filled_replicas = extract_histograms_formula(filename, treename, [bookings[i] for i in pending], exclude=exclude)
+        for i, hist, replica in zip(pending, filled, filled_replicas):
+            hists[i] = hist
+            if replica is not None: replicas[bookings[i]["histname"]] = replica
+            if HISTOGRAM_CACHE is not None:
+                HISTOGRAM_CACHE.put(cache_key(bookings[i]), hist)
+                if replica is not None: HISTOGRAM_CACHE.put_replicas(cache_key(bookings[i]), bootstrap, replica)
+    return hists
+
 def combine_histograms(histlist, finalname, xbins, xmin, xmax):
     cachehist = pyr.TH1F(finalname, finalname, xbins, xmin, xmax)
     print(histlist)
@@ -97,70 +520,96 @@ def combine_histograms(histlist, finalname, xbins, xmin, xmax):
 
 #def get_pt_range_name(pt_range): return f"{pt_range[0]}to{pt_range[1]}"
 
-parser = argparse.ArgumentParser()
-parser.add_argument("yamlpath", help="YAML spec file path")
-parser.add_argument("--diagnosis", help="Create diagnosis file, showing event contributions from each input ROOT file", action="store_true")
-args = parser.parse_args()
+def read_settings(yaml_spec):
+    settings = {}
+    settings["year"] = yaml_spec["year"]
+    settings["lumiunit"] = yaml_spec["lumiunit"]
+    settings["lumi"] = yaml_spec["lumi"]
+    # Luminosity must be fb. If in pb, convert to fb first.
+    #if settings["lumiunit"] == "pb": settings["lumi"] = settings["lumi"]*1000
 
-with open(args.yamlpath, "r") as yamlfile:
-    yaml_spec = yaml.safe_load(yamlfile)
+    settings["analysis_name"] = "."
+    if "analysisname" in yaml_spec.keys(): settings["analysis_name"] = yaml_spec["analysisname"]
 
-year_to_plot = yaml_spec["year"]
-lumi_unit_to_plot = yaml_spec["lumiunit"]
-lumi_to_plot = yaml_spec["lumi"]
-# Luminosity must be fb. If in pb, convert to fb first.
-#if lumi_unit_to_plot == "pb": lumi_to_plot = lumi_to_plot*1000
+    settings["categories"] = yaml_spec["categories"].keys()
+    settings["treename"] = yaml_spec["treename"]
+    settings["basecut"] = yaml_spec["basecut"]
 
-analysis_name = "."
-if "analysisname" in yaml_spec.keys(): analysis_name = yaml_spec["analysisname"]
-if analysis_name != ".": os.system(f"mkdir {analysis_name}")
+    settings["genweight"] = yaml_spec["genweight"]
 
-categories_to_plot = yaml_spec["categories"].keys()
-treename_to_plot = yaml_spec["treename"]
-basecut_to_plot = yaml_spec["basecut"]
+    settings["mass_variable"] = yaml_spec["distribution"]["mass_variable"]
+    settings["mass_range"]    = yaml_spec["distribution"]["mass_range"]
+    settings["mass_bins"]     = yaml_spec["distribution"]["mass_bins"]
 
-genweight_to_plot = yaml_spec["genweight"]
+    #pt_variable       = yaml_spec["distribution"]["pt_variable"]
+    #pt_ranges_to_plot = yaml_spec["distribution"]["pt_ranges"]
+    #pt_ranges_name = []
+    #for pt_range in pt_ranges_to_plot:
+    #    if len(pt_range) == 3: pt_ranges_name.append(pt_range[2])
+    #    else: pt_ranges_name.append(get_pt_range_name(pt_range))
 
-mass_variable = yaml_spec["distribution"]["mass_variable"]
-mass_range    = yaml_spec["distribution"]["mass_range"]
-mass_bins     = yaml_spec["distribution"]["mass_bins"]
+    settings["event_categories"] = [(e["name"], e["rule"]) for e in yaml_spec["distribution"]["event_categories"]]
+    settings["extra_variables"] = yaml_spec["distribution"].get("extra_variables", [])
 
-#pt_variable       = yaml_spec["distribution"]["pt_variable"]
-#pt_ranges_to_plot = yaml_spec["distribution"]["pt_ranges"]
-#pt_ranges_name = []
-#for pt_range in pt_ranges_to_plot:
-#    if len(pt_range) == 3: pt_ranges_name.append(pt_range[2])
-#    else: pt_ranges_name.append(get_pt_range_name(pt_range))
+    settings["tagger_name"] = yaml_spec["tagger"]["name"]
+    settings["tagger_cut_pass"], settings["tagger_cut_fail"] = tagger_cuts(yaml_spec)
 
-event_categories = [(e["name"], e["rule"]) for e in yaml_spec["distribution"]["event_categories"]]
+    settings["unc_to_plot"] = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc]["mode"] in ["factor", "file"]]
+    return settings
 
-tagger_name = yaml_spec["tagger"]["name"]
-if "cutrule" in yaml_spec["tagger"].keys():
-    tagger_cut_pass = yaml_spec["tagger"]["cutrule"]
-    tagger_cut_fail = f"!({tagger_cut_pass})"
-else:
-    tagger_varname = yaml_spec["tagger"]["varname"]
-    tagger_cut_pass = f'{tagger_varname}>={yaml_spec["tagger"]["cut"]}'
-    tagger_cut_fail = f'{tagger_varname}<{yaml_spec["tagger"]["cut"]}'
-
-unc_to_plot = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc]["mode"] in ["factor", "file"]]
+def add_perfileweights(yaml_spec, settings, skip=()):
+    applied = set()
+    if "perfileweights" not in yaml_spec.keys(): return applied
+    treename_to_plot = settings["treename"]
+    for weightset in yaml_spec["perfileweights"]:
+        branchname = weightset["name"]
+        branchvalue = float(weightset["value"])
+        for filename in weightset["files"]:
+            if (branchname, branchvalue, filename) in skip: continue
+            if HISTOGRAM_CACHE is not None: HISTOGRAM_CACHE.forget(filename)
+            rootfile = pyr.TFile(filename, "UPDATE")
+            roottree = rootfile.Get(treename_to_plot)
+            array_value = array('f', [0])
+            new_branch = roottree.Branch(branchname, array_value, branchname + "/F")
+            array_value[0] = branchvalue
+            for _ in range(roottree.GetEntries()): new_branch.Fill()
+            new_branch.ResetAddress()
+            roottree.Write(treename_to_plot, pyr.TObject.kOverwrite)
+            rootfile.Close()
+            applied.add((branchname, branchvalue, filename))
+    return applied
 
+def add_booking(bookings, filepath, target, key, histname, var, cut, weight, xbins, xmin, xmax, bootstrap=False):
+    # The filled histogram will be stored in target[key]
+    bookings.setdefault(filepath, []).append({
+        "target": target, "key": key, "histname": histname,
+        "var": var, "cut": cut, "weight": weight,
+        "xbins": xbins, "xmin": xmin, "xmax": xmax,
+        "bootstrap": bootstrap,
+    })
 
-def extract_hist_dict(filelist, process, weight, uncname="nominal"):
+def book_hist_dict(yaml_spec, settings, bookings, filelist, process, weight, uncname="nominal", control_dicts=None):
+    # control_dicts: {extra variable name: dictionary to store control histograms}, only booked if not None
     cache_dict = {}
+    mass_bins = settings["mass_bins"]
+    mass_range = settings["mass_range"]
     
     for filecount, filepath in enumerate(filelist):
         print(f"Debug: filepath = {filepath}")
         cache_dict[filepath] = {}
+        if control_dicts is not None:
+            for control_dict in control_dicts.values(): control_dict[filepath] = {}
         #for i, pt_range in enumerate(pt_ranges_to_plot):
-        for event_catname, event_catrule in event_categories:
+        for event_catname, event_catrule in settings["event_categories"]:
             #print(f"Debug: pt range = {pt_range}")
             print(f"Debug: event cat. name = {event_catname}")
             print(f"Debug: event cat. rule = {event_catrule}")
             #pt_range_name = pt_ranges_name[i]
             #pt_cut = f"({pt_variable} >= {pt_range[0]}) && ({pt_variable} < {pt_range[1]})"
             cache_dict[filepath][event_catname] = {}
-            for cat in categories_to_plot:
+            if control_dicts is not None:
+                for control_dict in control_dicts.values(): control_dict[filepath][event_catname] = {}
+            for cat in settings["categories"]:
                 print(f"Debug: cat = {cat}")
                 if process not in yaml_spec["categories"][cat]["processes"]: continue
                 category_cut = yaml_spec["categories"][cat]["cut"]
@@ -168,114 +617,151 @@ def extract_hist_dict(filelist, process, weight, uncname="nominal"):
                 histname = f"{process}_{uncname}_{filecount}_{event_catname}_{cat}"
                 
                 cache_dict[filepath][event_catname][cat] = {}
-                cache_dict[filepath][event_catname][cat]["pass"] = extract_histogram(
-                    filename=filepath, treename=treename_to_plot, var=mass_variable,
-                    cut=f"({basecut_to_plot})&&({category_cut})&&({event_catrule})&&({tagger_cut_pass})",
-                    weight=weight,
-                    histname=histname+"_pass",
-                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-                )
-                cache_dict[filepath][event_catname][cat]["fail"] = extract_histogram(
-                    filename=filepath, treename=treename_to_plot, var=mass_variable,
-                    cut=f"({basecut_to_plot})&&({category_cut})&&({event_catrule})&&({tagger_cut_fail})",
-                    weight=weight,
-                    histname=histname+"_fail",
-                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-                )
-                print(cache_dict[filepath][event_catname][cat])
-    
-    print(cache_dict)
+                for passing, tagger_cut in [("pass", settings["tagger_cut_pass"]), ("fail", settings["tagger_cut_fail"])]:
+                    cut = f"({settings['basecut']})&&({category_cut})&&({event_catrule})&&({tagger_cut})"
+                    add_booking(
+                        bookings, filepath, cache_dict[filepath][event_catname][cat], passing,
+                        histname=histname+"_"+passing, var=settings["mass_variable"], cut=cut, weight=weight,
+                        xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1], bootstrap=True
+                    )
+                    if control_dicts is None: continue
+                    for extra in settings["extra_variables"]:
+                        control_dict = control_dicts[extra["name"]][filepath][event_catname]
+                        control_dict.setdefault(cat, {})
+                        add_booking(
+                            bookings, filepath, control_dict[cat], passing,
+                            histname=f"{histname}_{passing}_{extra['name']}", var=extra["variable"], cut=cut, weight=weight,
+                            xbins=extra["bins"], xmin=extra["range"][0], xmax=extra["range"][1]
+                        )
                 
     return cache_dict
 
-if "perfileweights" in yaml_spec.keys():
-    for weightset in yaml_spec["perfileweights"]:
-        branchname = weightset["name"]
-        branchvalue = float(weightset["value"])
-        for filename in weightset["files"]:
-            rootfile = pyr.TFile(filename, "UPDATE")
-            roottree = rootfile.Get(treename_to_plot)
-            array_value = array('f', [0])
-            new_branch = roottree.Branch(branchname, array_value, branchname + "/F")
-            array_value[0] = branchvalue
-            for _ in range(roottree.GetEntries()): new_branch.Fill()
-            new_branch.ResetAddress()
-            roottree.Write(treename_to_plot, pyr.TObject.kOverwrite)
-            rootfile.Close()
-
-hist_plots_per_processes_and_files = {}
-for process in yaml_spec["processes"].keys():
-    hist_plots_per_processes_and_files[process] = {}
-    if process == "data": 
-        print("Debug: Data")
-        for filecount, filepath in enumerate(yaml_spec["processes"]["data"]["nominal_files"]):
-            hist_plots_per_processes_and_files["data"][filepath] = {}
-            #for i, pt_range in enumerate(pt_ranges_to_plot):
-            for event_catname, event_catrule in event_categories:
-                #pt_range_name = pt_ranges_name[i]
-                #pt_cut = f"({pt_variable} >= {pt_range[0]}) && ({pt_variable} < {pt_range[1]})"
-                hist_plots_per_processes_and_files["data"][filepath][event_catname] = {}
-                hist_plots_per_processes_and_files["data"][filepath][event_catname]["pass"] = extract_histogram(
-                    filename=filepath, treename=treename_to_plot, var=mass_variable,
-                    cut=f"({basecut_to_plot})&&({event_catrule})&&({tagger_cut_pass})",
-                    weight="1.",
-                    histname=f"data_{filecount}_{event_catname}_pass",
-                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+def book_all_histograms(yaml_spec, settings, bookings):
+    """
+    Books every histogram needed from every input file into bookings, {filepath: list of bookings}.
+    Returns the per-file fit templates and the per-file control histograms for each extra variable,
+    which are filled in place by fill_bookings.
+    """
+    mass_bins = settings["mass_bins"]
+    mass_range = settings["mass_range"]
+    hist_plots_per_processes_and_files = {}
+    control_hists_per_processes_and_files = {extra["name"]: {} for extra in settings["extra_variables"]}
+    for process in yaml_spec["processes"].keys():
+        hist_plots_per_processes_and_files[process] = {}
+        control_dicts = {}
+        for extra in settings["extra_variables"]:
+            control_hists_per_processes_and_files[extra["name"]][process] = {}
+            control_dicts[extra["name"]] = control_hists_per_processes_and_files[extra["name"]][process]
+        if process == "data": 
+            print("Debug: Data")
+            for filecount, filepath in enumerate(yaml_spec["processes"]["data"]["nominal_files"]):
+                hist_plots_per_processes_and_files["data"][filepath] = {}
+                for control_dict in control_dicts.values(): control_dict[filepath] = {}
+                #for i, pt_range in enumerate(pt_ranges_to_plot):
+                for event_catname, event_catrule in settings["event_categories"]:
+                    #pt_range_name = pt_ranges_name[i]
+                    #pt_cut = f"({pt_variable} >= {pt_range[0]}) && ({pt_variable} < {pt_range[1]})"
+                    hist_plots_per_processes_and_files["data"][filepath][event_catname] = {}
+                    for control_dict in control_dicts.values(): control_dict[filepath][event_catname] = {}
+                    for passing, tagger_cut in [("pass", settings["tagger_cut_pass"]), ("fail", settings["tagger_cut_fail"])]:
+                        cut = f"({settings['basecut']})&&({event_catrule})&&({tagger_cut})"
+                        add_booking(
+                            bookings, filepath, hist_plots_per_processes_and_files["data"][filepath][event_catname], passing,
+                            histname=f"data_{filecount}_{event_catname}_{passing}", var=settings["mass_variable"], cut=cut, weight="1.",
+                            xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1], bootstrap=True
+                        )
+                        for extra in settings["extra_variables"]:
+                            add_booking(
+                                bookings, filepath, control_dicts[extra["name"]][filepath][event_catname], passing,
+                                histname=f"data_{filecount}_{event_catname}_{passing}_{extra['name']}", var=extra["variable"], cut=cut, weight="1.",
+                                xbins=extra["bins"], xmin=extra["range"][0], xmax=extra["range"][1]
+                            )
+            continue
+        print(f"Debug: process = {process}")
+        
+        hist_plots_per_processes_and_files[process]["nominal"] = {}
+        for unc in settings["unc_to_plot"]:
+            print(f"Debug: unc = {unc}")
+            hist_plots_per_processes_and_files[process][unc+"_up"] = {}
+            hist_plots_per_processes_and_files[process][unc+"_down"] = {}
+        
+        weight_nominal = str(settings["lumi"]) + "*" + settings["genweight"]
+        if "additional_weights" in yaml_spec["processes"][process].keys(): 
+            weight_nominal += "*" + yaml_spec["processes"][process]["additional_weights"]
+        print(weight_nominal)
+        hist_plots_per_processes_and_files[process]["nominal"] = book_hist_dict(
+            yaml_spec, settings, bookings,
+            yaml_spec["processes"][process]["nominal_files"], 
+            process=process, weight=weight_nominal, control_dicts=control_dicts
+        )
+        
+        for unc in settings["unc_to_plot"]:
+            print(f"Debug: unc = {unc}")
+            if yaml_spec["uncertainties"][unc]["mode"] == "factor":
+                weight_uncup   = weight_nominal + "*" + yaml_spec["uncertainties"][unc]["up"]
+                weight_uncdown = weight_nominal + "*" + yaml_spec["uncertainties"][unc]["down"]
+                print(weight_uncup)
+                print(weight_uncdown)
+                hist_plots_per_processes_and_files[process][unc+"_up"] = book_hist_dict(
+                    yaml_spec, settings, bookings,
+                    yaml_spec["processes"][process]["nominal_files"], 
+                    process=process, weight=weight_uncup, uncname=unc+"_up"
                 )
-                hist_plots_per_processes_and_files["data"][filepath][event_catname]["fail"] = extract_histogram(
-                    filename=filepath, treename=treename_to_plot, var=mass_variable,
-                    cut=f"({basecut_to_plot})&&({event_catrule})&&({tagger_cut_fail})",
-                    weight="1.",
-                    histname=f"data_{filecount}_{event_catname}_fail",
-                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+                hist_plots_per_processes_and_files[process][unc+"_down"] = book_hist_dict(
+                    yaml_spec, settings, bookings,
+                    yaml_spec["processes"][process]["nominal_files"], 
+                    process=process, weight=weight_uncdown, uncname=unc+"_down"
                 )
-        continue
-    print(f"Debug: process = {process}")
-    
-    hist_plots_per_processes_and_files[process]["nominal"] = {}
-    for unc in unc_to_plot:
-        print(f"Debug: unc = {unc}")
-        hist_plots_per_processes_and_files[process][unc+"_up"] = {}
-        hist_plots_per_processes_and_files[process][unc+"_down"] = {}
-    
-    weight_nominal = str(lumi_to_plot) + "*" + genweight_to_plot
-    if "additional_weights" in yaml_spec["processes"][process].keys(): 
-        weight_nominal += "*" + yaml_spec["processes"][process]["additional_weights"]
-    print(weight_nominal)
-    hist_plots_per_processes_and_files[process]["nominal"] = extract_hist_dict(
-        yaml_spec["processes"][process]["nominal_files"], 
-        process=process, weight=weight_nominal
-    )
-    print(hist_plots_per_processes_and_files[process]["nominal"])
+            elif yaml_spec["uncertainties"][unc]["mode"] == "file":
+                hist_plots_per_processes_and_files[process][unc+"_up"] = book_hist_dict(
+                    yaml_spec, settings, bookings,
+                    yaml_spec["processes"][process]["unc_files"][unc]["up"], 
+                    process=process, weight=weight_nominal, uncname=unc+"_up"
+                )
+                hist_plots_per_processes_and_files[process][unc+"_down"] = book_hist_dict(
+                    yaml_spec, settings, bookings,
+                    yaml_spec["processes"][process]["unc_files"][unc]["down"], 
+                    process=process, weight=weight_nominal, uncname=unc+"_down"
+                )
+
+    return hist_plots_per_processes_and_files, control_hists_per_processes_and_files
+
+def fill_bookings(spec_bookings, engine="formula", bootstrap=None, replicas=None):
+    """
+    Fills the bookings of one or more specs, with one pass per input file shared by all specs.
+    spec_bookings: list of (treename, excluded_entries, bookings), one per spec,
+    where excluded_entries is {filename: sorted array of entries to skip} or None.
+    Identical bookings (same file, tree, skipped entries, variable, cut, weight and binning) are only filled once.
+    Bootstrap replicas are stored in replicas, keyed by histogram name.
+    """
+    groups = {}
+    for treename, excluded_entries, bookings in spec_bookings:
+        for filepath, file_bookings in bookings.items():
+            exclude = excluded_entries.get(filepath) if excluded_entries is not None else None
+            exclude_signature = None if exclude is None else (len(exclude), zlib.crc32(exclude.tobytes()))
+            group = groups.setdefault((filepath, treename, exclude_signature), {"exclude": exclude, "bookings": []})
+            group["bookings"] += file_bookings
     
-    for unc in unc_to_plot:
-        print(f"Debug: unc = {unc}")
-        if yaml_spec["uncertainties"][unc]["mode"] == "factor":
-            weight_uncup   = weight_nominal + "*" + yaml_spec["uncertainties"][unc]["up"]
-            weight_uncdown = weight_nominal + "*" + yaml_spec["uncertainties"][unc]["down"]
-            print(weight_uncup)
-            print(weight_uncdown)
-            hist_plots_per_processes_and_files[process][unc+"_up"] = extract_hist_dict(
-                yaml_spec["processes"][process]["nominal_files"], 
-                process=process, weight=weight_uncup, uncname=unc+"_up"
-            )
-            hist_plots_per_processes_and_files[process][unc+"_down"] = extract_hist_dict(
-                yaml_spec["processes"][process]["nominal_files"], 
-                process=process, weight=weight_uncdown, uncname=unc+"_down"
-            )
-        elif yaml_spec["uncertainties"][unc]["mode"] == "file":
-            hist_plots_per_processes_and_files[process][unc+"_up"] = extract_hist_dict(
-                yaml_spec["processes"][process]["unc_files"][unc]["up"], 
-                process=process, weight=weight_nominal, uncname=unc+"_up"
-            )
-            hist_plots_per_processes_and_files[process][unc+"_down"] = extract_hist_dict(
-                yaml_spec["processes"][process]["unc_files"][unc]["down"], 
-                process=process, weight=weight_nominal, uncname=unc+"_down"
-            )
+    for (filepath, treename, _), group in groups.items():
+        unique = {}
+        for b in group["bookings"]:
+            unique.setdefault((b["var"], b["cut"], b["weight"], b["xbins"], b["xmin"], b["xmax"], b["bootstrap"]), []).append(b)
+        same_bookings = list(unique.values())
+        print(f"Debug: {len(same_bookings)} unique histograms out of {len(group['bookings'])} booked from {filepath}")
+        hists = extract_file_histograms(
+            filepath, treename, [same[0] for same in same_bookings],
+            engine=engine, bootstrap=bootstrap, replicas=replicas, exclude=group["exclude"]
+        )
+        for same, hist in zip(same_bookings, hists):
+            same[0]["target"][same[0]["key"]] = hist
+            for b in same[1:]:
+                b["target"][b["key"]] = hist.Clone(b["histname"])
+                b["target"][b["key"]].SetDirectory(pyr.gROOT)
+                if replicas is not None and same[0]["histname"] in replicas.keys(): replicas[b["histname"]] = replicas[same[0]["histname"]]
 
-if args.diagnosis:
+def save_diagnosis(settings, hist_plots_per_processes_and_files):
     #for i, pt_range in enumerate(pt_ranges_to_plot):
-    for event_catname, event_catrule in event_categories:
+    for event_catname, event_catrule in settings["event_categories"]:
         #pt_range_name = pt_ranges_name[i]
         diagnosis_file = pyr.TFile(f"diagnosis_{event_catname}.root", "RECREATE")
         for process in hist_plots_per_processes_and_files.keys():
@@ -287,217 +773,335 @@ if args.diagnosis:
                             hist_plots_per_processes_and_files[process][uncvariant][filepath][event_catname][category]["fail"].Write()
         diagnosis_file.Close()
 
-hist_data_per_ptrange = {}
-#for i, pt_range in enumerate(pt_ranges_to_plot):
-    #pt_range_name = pt_ranges_name[i]
-for event_catname, event_catrule in event_categories:
-    hist_data_per_ptrange[event_catname] = {"pass": {}, "fail": {}}
-    hist_data_per_ptrange[event_catname]["pass"] = combine_histograms(
-        [hist_plots_per_processes_and_files["data"][filepath][event_catname]["pass"] for filepath in hist_plots_per_processes_and_files["data"].keys()],
-        finalname=f"data_{event_catname}_pass", 
-        xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-    )
-    hist_data_per_ptrange[event_catname]["fail"] = combine_histograms(
-        [hist_plots_per_processes_and_files["data"][filepath][event_catname]["fail"] for filepath in hist_plots_per_processes_and_files["data"].keys()],
-        finalname=f"data_{event_catname}_fail", 
-        xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-    )
+def build_analysis_histograms(yaml_spec, settings, hist_plots_per_processes_and_files):
+    mass_bins = settings["mass_bins"]
+    mass_range = settings["mass_range"]
+    unc_to_plot = settings["unc_to_plot"]
 
-hist_plots_per_category = {}
-for category in categories_to_plot:
-    print(f"Debug: category = {category}")
-    hist_plots_per_category[category] = {}
-    hist_plots_per_category[category]["nominal"] = {}
-    for unc in unc_to_plot:
-        hist_plots_per_category[category][unc+"_up"] = {}
-        hist_plots_per_category[category][unc+"_down"] = {}
-    
+    hist_data_per_ptrange = {}
     #for i, pt_range in enumerate(pt_ranges_to_plot):
         #pt_range_name = pt_ranges_name[i]
-    for event_catname, event_catrule in event_categories:
-        hist_plots_per_category[category]["nominal"][event_catname] = {}
-        passing_list = []
-        failing_list = []
-        for process in yaml_spec["categories"][category]["processes"]:
-            for filepath in hist_plots_per_processes_and_files[process]["nominal"].keys():
-                passing_list.append(hist_plots_per_processes_and_files[process]["nominal"][filepath][event_catname][category]["pass"])
-                failing_list.append(hist_plots_per_processes_and_files[process]["nominal"][filepath][event_catname][category]["fail"])
-        hist_plots_per_category[category]["nominal"][event_catname]["pass"] = combine_histograms(
-            histlist=passing_list,
-            finalname=f"{category}_{event_catname}_pass_nominal",
+    for event_catname, event_catrule in settings["event_categories"]:
+        hist_data_per_ptrange[event_catname] = {"pass": {}, "fail": {}}
+        hist_data_per_ptrange[event_catname]["pass"] = combine_histograms(
+            [hist_plots_per_processes_and_files["data"][filepath][event_catname]["pass"] for filepath in hist_plots_per_processes_and_files["data"].keys()],
+            finalname=f"data_{event_catname}_pass", 
             xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
         )
-        hist_plots_per_category[category]["nominal"][event_catname]["fail"] = combine_histograms(
-            histlist=failing_list,
-            finalname=f"{category}_{event_catname}_fail_nominal",
+        hist_data_per_ptrange[event_catname]["fail"] = combine_histograms(
+            [hist_plots_per_processes_and_files["data"][filepath][event_catname]["fail"] for filepath in hist_plots_per_processes_and_files["data"].keys()],
+            finalname=f"data_{event_catname}_fail", 
             xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
         )
-        
+
+    hist_plots_per_category = {}
+    for category in settings["categories"]:
+        print(f"Debug: category = {category}")
+        hist_plots_per_category[category] = {}
+        hist_plots_per_category[category]["nominal"] = {}
         for unc in unc_to_plot:
-            hist_plots_per_category[category][unc+"_up"][event_catname] = {}
-            hist_plots_per_category[category][unc+"_down"][event_catname] = {}
-            passing_list_up   = []
-            passing_list_down = []
-            failing_list_up   = []
-            failing_list_down = []
+            hist_plots_per_category[category][unc+"_up"] = {}
+            hist_plots_per_category[category][unc+"_down"] = {}
+        
+        #for i, pt_range in enumerate(pt_ranges_to_plot):
+            #pt_range_name = pt_ranges_name[i]
+        for event_catname, event_catrule in settings["event_categories"]:
+            hist_plots_per_category[category]["nominal"][event_catname] = {}
+            passing_list = []
+            failing_list = []
             for process in yaml_spec["categories"][category]["processes"]:
-                for filepath in hist_plots_per_processes_and_files[process][unc+"_up"].keys():
-                    passing_list_up.append(hist_plots_per_processes_and_files[process][unc+"_up"][filepath][event_catname][category]["pass"])
-                    failing_list_up.append(hist_plots_per_processes_and_files[process][unc+"_up"][filepath][event_catname][category]["fail"])
-                for filepath in hist_plots_per_processes_and_files[process][unc+"_down"].keys():
-                    passing_list_down.append(hist_plots_per_processes_and_files[process][unc+"_down"][filepath][event_catname][category]["pass"])
-                    failing_list_down.append(hist_plots_per_processes_and_files[process][unc+"_down"][filepath][event_catname][category]["fail"])
-                    
-            hist_plots_per_category[category][unc+"_up"][event_catname]["pass"] = combine_histograms(
-                histlist=passing_list_up,
-                finalname=f"{category}_{event_catname}_pass_{unc}Up",
+                for filepath in hist_plots_per_processes_and_files[process]["nominal"].keys():
+                    passing_list.append(hist_plots_per_processes_and_files[process]["nominal"][filepath][event_catname][category]["pass"])
+                    failing_list.append(hist_plots_per_processes_and_files[process]["nominal"][filepath][event_catname][category]["fail"])
+            hist_plots_per_category[category]["nominal"][event_catname]["pass"] = combine_histograms(
+                histlist=passing_list,
+                finalname=f"{category}_{event_catname}_pass_nominal",
                 xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
             )
-            hist_plots_per_category[category][unc+"_up"][event_catname]["fail"] = combine_histograms(
-                histlist=failing_list_up,
-                finalname=f"{category}_{event_catname}_fail_{unc}Up",
+            hist_plots_per_category[category]["nominal"][event_catname]["fail"] = combine_histograms(
+                histlist=failing_list,
+                finalname=f"{category}_{event_catname}_fail_nominal",
                 xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
             )
             
-            hist_plots_per_category[category][unc+"_down"][event_catname]["pass"] = combine_histograms(
-                histlist=passing_list_down,
-                finalname=f"{category}_{event_catname}_pass_{unc}Down",
-                xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-            )
-            hist_plots_per_category[category][unc+"_down"][event_catname]["fail"] = combine_histograms(
-                histlist=failing_list_down,
-                finalname=f"{category}_{event_catname}_fail_{unc}Down",
-                xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
-            )
+            for unc in unc_to_plot:
+                hist_plots_per_category[category][unc+"_up"][event_catname] = {}
+                hist_plots_per_category[category][unc+"_down"][event_catname] = {}
+                passing_list_up   = []
+                passing_list_down = []
+                failing_list_up   = []
+                failing_list_down = []
+                for process in yaml_spec["categories"][category]["processes"]:
+                    for filepath in hist_plots_per_processes_and_files[process][unc+"_up"].keys():
+                        passing_list_up.append(hist_plots_per_processes_and_files[process][unc+"_up"][filepath][event_catname][category]["pass"])
+                        failing_list_up.append(hist_plots_per_processes_and_files[process][unc+"_up"][filepath][event_catname][category]["fail"])
+                    for filepath in hist_plots_per_processes_and_files[process][unc+"_down"].keys():
+                        passing_list_down.append(hist_plots_per_processes_and_files[process][unc+"_down"][filepath][event_catname][category]["pass"])
+                        failing_list_down.append(hist_plots_per_processes_and_files[process][unc+"_down"][filepath][event_catname][category]["fail"])
+                        
+                hist_plots_per_category[category][unc+"_up"][event_catname]["pass"] = combine_histograms(
+                    histlist=passing_list_up,
+                    finalname=f"{category}_{event_catname}_pass_{unc}Up",
+                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+                )
+                hist_plots_per_category[category][unc+"_up"][event_catname]["fail"] = combine_histograms(
+                    histlist=failing_list_up,
+                    finalname=f"{category}_{event_catname}_fail_{unc}Up",
+                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+                )
+                
+                hist_plots_per_category[category][unc+"_down"][event_catname]["pass"] = combine_histograms(
+                    histlist=passing_list_down,
+                    finalname=f"{category}_{event_catname}_pass_{unc}Down",
+                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+                )
+                hist_plots_per_category[category][unc+"_down"][event_catname]["fail"] = combine_histograms(
+                    histlist=failing_list_down,
+                    finalname=f"{category}_{event_catname}_fail_{unc}Down",
+                    xbins=mass_bins, xmin=mass_range[0], xmax=mass_range[1]
+                )
 
-for category in hist_plots_per_category.keys():
-    print("=====================")
-    print(f"Category: {category}")
-    for unc in hist_plots_per_category[category].keys():
-        print(f"Uncertainty: {unc}")
-        for pt_range in hist_plots_per_category[category][unc].keys():
-            print(f"pT range: {pt_range}")
-            for passorfail in hist_plots_per_category[category][unc][pt_range].keys():
-                print(passorfail)
-                print(hist_plots_per_category[category][unc][pt_range][passorfail])
-
-analysis_obj_collection = {}
-#for i, pt_range in enumerate(pt_ranges_to_plot):
-for event_catname, event_catrule in event_categories:
-    analysis_hist_obj = AnalysisHistogram(categories_to_plot, mass_bins, mass_range[0], mass_range[1], treename_to_plot)
-    #pt_range_name = pt_ranges_name[i]
-    analysis_hist_obj.add_data_hist(hist=hist_data_per_ptrange[event_catname]["pass"], isPass=True)
-    analysis_hist_obj.add_data_hist(hist=hist_data_per_ptrange[event_catname]["fail"], isPass=False)
-    for category in categories_to_plot:
-        analysis_hist_obj.add_nominal_hist(
-            category=category, 
-            histobj=hist_plots_per_category[category]["nominal"][event_catname]["pass"],
-            isPass=True
-        )
-        analysis_hist_obj.add_nominal_hist(
-            category=category, 
-            histobj=hist_plots_per_category[category]["nominal"][event_catname]["fail"],
-            isPass=False
-        )
-        for unc in unc_to_plot:
-            analysis_hist_obj.define_unc(category=category, unc=unc)
-            analysis_hist_obj.add_unc_hist(
-                category=category, unc=unc,
-                histobj=hist_plots_per_category[category][unc+"_up"][event_catname]["pass"], 
-                isUp=True, isPass=True
-            )
-            analysis_hist_obj.add_unc_hist(
-                category=category, unc=unc,
-                histobj=hist_plots_per_category[category][unc+"_down"][event_catname]["pass"], 
-                isUp=False, isPass=True
+    for category in hist_plots_per_category.keys():
+        print("=====================")
+        print(f"Category: {category}")
+        for unc in hist_plots_per_category[category].keys():
+            print(f"Uncertainty: {unc}")
+            for pt_range in hist_plots_per_category[category][unc].keys():
+                print(f"pT range: {pt_range}")
+                for passorfail in hist_plots_per_category[category][unc][pt_range].keys():
+                    print(passorfail)
+                    print(hist_plots_per_category[category][unc][pt_range][passorfail])
+
+    analysis_obj_collection = {}
+    #for i, pt_range in enumerate(pt_ranges_to_plot):
+    for event_catname, event_catrule in settings["event_categories"]:
+        analysis_hist_obj = AnalysisHistogram(settings["categories"], mass_bins, mass_range[0], mass_range[1], settings["treename"])
+        #pt_range_name = pt_ranges_name[i]
+        analysis_hist_obj.add_data_hist(hist=hist_data_per_ptrange[event_catname]["pass"], isPass=True)
+        analysis_hist_obj.add_data_hist(hist=hist_data_per_ptrange[event_catname]["fail"], isPass=False)
+        for category in settings["categories"]:
+            analysis_hist_obj.add_nominal_hist(
+                category=category, 
+                histobj=hist_plots_per_category[category]["nominal"][event_catname]["pass"],
+                isPass=True
             )
-            analysis_hist_obj.add_unc_hist(
-                category=category, unc=unc,
-                histobj=hist_plots_per_category[category][unc+"_up"][event_catname]["fail"], 
-                isUp=True, isPass=False
+            analysis_hist_obj.add_nominal_hist(
+                category=category, 
+                histobj=hist_plots_per_category[category]["nominal"][event_catname]["fail"],
+                isPass=False
             )
-            analysis_hist_obj.add_unc_hist(
-                category=category, unc=unc,
-                histobj=hist_plots_per_category[category][unc+"_down"][event_catname]["fail"], 
-                isUp=False, isPass=False
+            for unc in unc_to_plot:
+                analysis_hist_obj.define_unc(category=category, unc=unc)
+                analysis_hist_obj.add_unc_hist(
+                    category=category, unc=unc,
+                    histobj=hist_plots_per_category[category][unc+"_up"][event_catname]["pass"], 
+                    isUp=True, isPass=True
+                )
+                analysis_hist_obj.add_unc_hist(
+                    category=category, unc=unc,
+                    histobj=hist_plots_per_category[category][unc+"_down"][event_catname]["pass"], 
+                    isUp=False, isPass=True
+                )
+                analysis_hist_obj.add_unc_hist(
+                    category=category, unc=unc,
+                    histobj=hist_plots_per_category[category][unc+"_up"][event_catname]["fail"], 
+                    isUp=True, isPass=False
+                )
+                analysis_hist_obj.add_unc_hist(
+                    category=category, unc=unc,
+                    histobj=hist_plots_per_category[category][unc+"_down"][event_catname]["fail"], 
+                    isUp=False, isPass=False
+                )
+        analysis_obj_collection[event_catname] = analysis_hist_obj
+    return analysis_obj_collection
+
+def save_outputs(yaml_spec, settings, analysis_obj_collection, unfloored=False):
+    # unfloored: also save {key}_unfloored.root, before empty bins are set to 0.01
+    analysis_name = settings["analysis_name"]
+    print(analysis_obj_collection)
+    for key in analysis_obj_collection.keys():
+        print(analysis_obj_collection[key].__dict__)
+        if unfloored: analysis_obj_collection[key].save_histograms(f"{analysis_name}/{key}_unfloored.root", floor_zero_bins=False)
+        analysis_obj_collection[key].save_histograms(f"{analysis_name}/{key}.root")
+    # Datacards only need the yields, so they can be remade with make_datacards.py without the histograms
+    summary = yields_summary(analysis_obj_collection)
+    save_yields(summary, analysis_name)
+    make_datacards(yaml_spec, summary=summary)
+
+def build_control_histograms(yaml_spec, settings, control_hists_per_processes_and_files):
+    # Sums control histograms over files (and processes) into {event category: {variable: {category or "data": {"pass": hist, "fail": hist}}}}
+    control_collection = {}
+    for event_catname, event_catrule in settings["event_categories"]:
+        control_collection[event_catname] = {}
+        for extra in settings["extra_variables"]:
+            varname = extra["name"]
+            control_hists = control_hists_per_processes_and_files[varname]
+            control_collection[event_catname][varname] = {"data": {}}
+            for passing in ["pass", "fail"]:
+                control_collection[event_catname][varname]["data"][passing] = combine_histograms(
+                    [control_hists["data"][filepath][event_catname][passing] for filepath in control_hists["data"].keys()],
+                    finalname=f"data_{event_catname}_{passing}_{varname}",
+                    xbins=extra["bins"], xmin=extra["range"][0], xmax=extra["range"][1]
+                )
+            for category in settings["categories"]:
+                control_collection[event_catname][varname][category] = {}
+                for passing in ["pass", "fail"]:
+                    histlist = []
+                    for process in yaml_spec["categories"][category]["processes"]:
+                        for filepath in control_hists[process].keys():
+                            histlist.append(control_hists[process][filepath][event_catname][category][passing])
+                    control_collection[event_catname][varname][category][passing] = combine_histograms(
+                        histlist=histlist,
+                        finalname=f"{category}_{event_catname}_{passing}_{varname}",
+                        xbins=extra["bins"], xmin=extra["range"][0], xmax=extra["range"][1]
+                    )
+    return control_collection
+
+def save_control_histograms(settings, control_collection):
+    for event_catname in control_collection.keys():
+        savefile = pyr.TFile(f"{settings['analysis_name']}/{event_catname}_controls.root", "RECREATE")
+        for varname in control_collection[event_catname].keys():
+            for name in control_collection[event_catname][varname].keys():
+                control_collection[event_catname][varname][name]["pass"].Write()
+                control_collection[event_catname][varname][name]["fail"].Write()
+        savefile.Close()
+
+def build_bootstrap_replicas(yaml_spec, settings, hist_plots_per_processes_and_files, replicas, nreplicas):
+    # Sums per-file replicas in the same way as build_analysis_histograms, keyed by the final histogram names
+    mass_bins = settings["mass_bins"]
+    replica_collection = {}
+    for event_catname, event_catrule in settings["event_categories"]:
+        replica_collection[event_catname] = {}
+        for passing in ["pass", "fail"]:
+            replica_collection[event_catname][f"data_{event_catname}_{passing}"] = sum(
+                [replicas[hist_plots_per_processes_and_files["data"][filepath][event_catname][passing].GetName()] for filepath in hist_plots_per_processes_and_files["data"].keys()],
+                np.zeros((nreplicas, mass_bins))
             )
-    analysis_obj_collection[event_catname] = analysis_hist_obj
-print(analysis_obj_collection)
-for key in analysis_obj_collection.keys():
-    print(analysis_obj_collection[key].__dict__)
-    analysis_obj_collection[key].save_histograms(f"{analysis_name}/{key}.root")
+            variants = [("nominal", "nominal")]
+            for unc in settings["unc_to_plot"]: variants += [(unc+"_up", unc+"Up"), (unc+"_down", unc+"Down")]
+            for category in settings["categories"]:
+                for uncvariant, suffix in variants:
+                    histlist = []
+                    for process in yaml_spec["categories"][category]["processes"]:
+                        for filepath in hist_plots_per_processes_and_files[process][uncvariant].keys():
+                            histlist.append(hist_plots_per_processes_and_files[process][uncvariant][filepath][event_catname][category][passing])
+                    replica_collection[event_catname][f"{category}_{event_catname}_{passing}_{suffix}"] = sum(
+                        [replicas[hist.GetName()] for hist in histlist], np.zeros((nreplicas, mass_bins))
+                    )
+    return replica_collection
+
+def save_bootstrap_replicas(settings, replica_collection, bootstrap):
+    mass_range = settings["mass_range"]
+    for event_catname in replica_collection.keys():
+        np.savez_compressed(
+            f"{settings['analysis_name']}/{event_catname}_bootstrap.npz",
+            edges=np.linspace(mass_range[0], mass_range[1], settings["mass_bins"]+1),
+            nreplicas=bootstrap[0],
+            seed=bootstrap[1],
+            **replica_collection[event_catname]
+        )
+
+def find_data_duplicates(yaml_spec, settings, run_duplicates=None):
+    # run_duplicates: {(file list, tree, branches): result} shared by the specs of one run, so that specs with the same data files search once
+    data_config = yaml_spec["processes"]["data"]
+    filelist = data_config["nominal_files"]
+    branches = data_config.get("dedup_branches", DEFAULT_DEDUP_BRANCHES)
+    cache_key = (tuple(filelist), settings["treename"], tuple(branches))
+    if run_duplicates is not None and cache_key in run_duplicates.keys():
+        excluded_entries, pair_counts = run_duplicates[cache_key]
+    elif HISTOGRAM_CACHE is not None:
+        # Only the latest result is kept for each file list, so changed input files replace their old result
+        signature = tuple(HISTOGRAM_CACHE.file_signature(filename) for filename in filelist)
+        if HISTOGRAM_CACHE.duplicates.get(cache_key, (None,))[0] != signature:
+            HISTOGRAM_CACHE.duplicates[cache_key] = (signature, find_duplicates(filelist, settings["treename"], branches))
+        excluded_entries, pair_counts = HISTOGRAM_CACHE.duplicates[cache_key][1]
+    else:
+        excluded_entries, pair_counts = find_duplicates(filelist, settings["treename"], branches)
+    if run_duplicates is not None: run_duplicates[cache_key] = (excluded_entries, pair_counts)
+    print_duplicate_report(pair_counts)
+    save_duplicate_report(pair_counts, f"{settings['analysis_name']}/data_duplicates.yaml")
+    return excluded_entries
+
+def make_histograms(yaml_spec, diagnosis=False, engine="formula", bootstrap=None, unfloored=False):
+    # bootstrap: (number of replicas, seed) to also fill Poisson bootstrap replicas of every template, rdf engine only
+    # unfloored: also save the analysis histograms before empty bins are set to 0.01, used by compare_outputs.py
+    return make_histograms_multi([yaml_spec], diagnosis=diagnosis, engine=engine, bootstrap=bootstrap, unfloored=unfloored)[0]
+
+def make_histograms_multi(yaml_specs, diagnosis=False, engine="formula", bootstrap=None, unfloored=False):
+    """
+    Makes the outputs of several specs, each in its own analysisname directory,
+    reading every input file only once for all specs. Returns the analysis histograms of each spec.
+    Bootstrap replicas and diagnosis files are only supported for a single spec.
+    """
+    if bootstrap is not None and len(yaml_specs) > 1: raise ValueError("Bootstrap replicas are only supported for a single spec")
+    # Diagnosis files are written to the current directory, so several specs would overwrite each other
+    if diagnosis and len(yaml_specs) > 1: raise ValueError("Diagnosis files are only supported for a single spec")
+    clear_dedup_registry()
+    runs = []
+    run_duplicates = {}
+    for yaml_spec in yaml_specs:
+        settings = read_settings(yaml_spec)
+        if settings["analysis_name"] != "." and not os.path.isdir(settings["analysis_name"]): os.system(f"mkdir {settings['analysis_name']}")
+        excluded_entries = None
+        if yaml_spec["processes"]["data"].get("deduplicate", False): excluded_entries = find_data_duplicates(yaml_spec, settings, run_duplicates=run_duplicates)
+        bookings = {}
+        hist_plots_per_processes_and_files, control_hists_per_processes_and_files = book_all_histograms(yaml_spec, settings, bookings)
+        runs.append((yaml_spec, settings, excluded_entries, bookings, hist_plots_per_processes_and_files, control_hists_per_processes_and_files))
     
-    number_of_categories = len(analysis_obj_collection[key].categories)
-    data_pass_count = analysis_obj_collection[key].data_hist["pass"].Integral(1, analysis_obj_collection[key].data_hist["pass"].GetNbinsX())
-    data_fail_count = analysis_obj_collection[key].data_hist["fail"].Integral(1, analysis_obj_collection[key].data_hist["fail"].GetNbinsX())
-    mc_pass_count = 0
-    mc_fail_count = 0
-    for category in analysis_obj_collection[key].categories:
-        pass_bins = analysis_obj_collection[key].nom_hist[category]["pass"].GetNbinsX()
-        fail_bins = analysis_obj_collection[key].nom_hist[category]["fail"].GetNbinsX()
-        mc_pass_count += analysis_obj_collection[key].nom_hist[category]["pass"].Integral(1, pass_bins)
-        mc_fail_count += analysis_obj_collection[key].nom_hist[category]["fail"].Integral(1, fail_bins)
-    norm_match_mc_to_data = (data_pass_count + data_fail_count) / (mc_pass_count + mc_fail_count)
+    replicas = {}
+    fill_bookings([(settings["treename"], excluded_entries, bookings) for _, settings, excluded_entries, bookings, _, _ in runs], engine=engine, bootstrap=bootstrap, replicas=replicas)
     
-    print(f"Printing datacard {key}.txt")
-    with open(f"{analysis_name}/{key}.txt", 'w') as combine_card_file:
-        combine_lines = []
-        
-        combine_lines.append("imax 2 (two channels, pass and fail)\n")
-        combine_lines.append(f"jmax {number_of_categories-1} ({number_of_categories} categories minus 1)\n")
-        combine_lines.append("kmax * (automatic number of nuisance parameters)\n")
-        combine_lines.append("----------\n")
-        
-        combine_lines.append(f"shapes data_obs pass {key}.root data_{key}_pass\n")
-        combine_lines.append(f"shapes * pass {key}.root $PROCESS_{key}_pass_nominal $PROCESS_{key}_pass_$SYSTEMATIC\n")
-        combine_lines.append(f"shapes data_obs fail {key}.root data_{key}_fail\n")
-        combine_lines.append(f"shapes * fail {key}.root $PROCESS_{key}_fail_nominal $PROCESS_{key}_fail_$SYSTEMATIC\n")
-        combine_lines.append("----------\n")
-        
-        combine_lines.append("bin\tpass\tfail\n")
-        combine_lines.append(f"observation\t{data_pass_count:.0f}\t{data_fail_count:.0f}\n")
-        combine_lines.append("----------\n")
-        
-        combine_lines.append("# automatic counting of MC events\n")
-        combine_lines.append("bin\t" + "pass\t"*number_of_categories + "fail\t"*number_of_categories + '\n')
-        combine_lines.append("process\t"+'\t'.join(list(analysis_obj_collection[key].categories)*2) + '\n')
-        combine_lines.append("process\t"+'\t'.join(list(map(str, range(number_of_categories)))*2) + '\n')
-        combine_lines.append("rate\t"+"-1\t"*number_of_categories*2 + '\n')
-        combine_lines.append("----------\n")
-        
-        for unc in yaml_spec["uncertainties"].keys():
-            unc_line = unc + '\t'
-            unc_size = ""
-            unc_size_number = yaml_spec["uncertainties"][unc]["size"] if "size" in yaml_spec["uncertainties"][unc] else 1
-            if yaml_spec["uncertainties"][unc]["mode"] in ["factor", "file"]: 
-                unc_line += "shape\t"
-            else: 
-                unc_line += yaml_spec["uncertainties"][unc]["mode"] + '\t'
-            if "category" in yaml_spec["uncertainties"][unc].keys():
-                for category in analysis_obj_collection[key].categories:
-                    if category == yaml_spec["uncertainties"][unc]["category"]: unc_size += f"{unc_size_number}\t"
-                    else: unc_size += "-\t"
-                unc_size = unc_size + unc_size
-            else:
-                unc_size = '\t'.join([f"{unc_size_number}"]*number_of_categories*2)
-            combine_lines.append(unc_line+unc_size+'\n')
-        combine_lines.append("# normalisation factor to match MC and data\n")
-        combine_lines.append("# freezes automatically\n")
-        combine_lines.append(f"norm_match_mc_data rateParam * * {norm_match_mc_to_data:.6f}\n")
-        combine_lines.append("nuisance edit freeze norm_match_mc_data\n")
-        combine_lines.append("\n")
-        combine_lines.append("# activating autoMCStats\n")
-        combine_lines.append("* autoMCStats 0\n")
-        
-        combine_card_file.writelines(combine_lines)
+    analysis_obj_collections = []
+    for yaml_spec, settings, _, _, hist_plots_per_processes_and_files, control_hists_per_processes_and_files in runs:
+        print(hist_plots_per_processes_and_files)
+        if bootstrap is not None:
+            save_bootstrap_replicas(settings, build_bootstrap_replicas(yaml_spec, settings, hist_plots_per_processes_and_files, replicas, bootstrap[0]), bootstrap)
+        if diagnosis: save_diagnosis(settings, hist_plots_per_processes_and_files)
+        analysis_obj_collection = build_analysis_histograms(yaml_spec, settings, hist_plots_per_processes_and_files)
+        save_outputs(yaml_spec, settings, analysis_obj_collection, unfloored=unfloored)
+        if settings["extra_variables"]:
+            save_control_histograms(settings, build_control_histograms(yaml_spec, settings, control_hists_per_processes_and_files))
+        analysis_obj_collections.append(analysis_obj_collection)
+    return analysis_obj_collections
 
-print(f"Printing combine script file combine_script.sh")
-with open(f"{analysis_name}/combine_script.sh", 'w') as combine_script_file:
-    combine_script_file.write("#!/bin/bash\n")
-    combine_script_file.write("# Converting datacards to workspace file for portability :-)\n")
-    for key in analysis_obj_collection.keys():
-        combine_script_file.write(f"text2workspace.py -m 125 -P HiggsAnalysis.CombinedLimit.TagAndProbeExtended:tagAndProbe {key}.txt -o workspace_{key}.root --PO=categories={','.join(categories_to_plot)}\n")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, several specs are made in one pass over their common input files", nargs="+")
+    parser.add_argument("--diagnosis", help="Create diagnosis file, showing event contributions from each input ROOT file", action="store_true")
+    parser.add_argument("--validate", help="Only validate the spec against all input files, then exit", action="store_true")
+    parser.add_argument("--skip-validation", help="Do not validate the spec against input files before making histograms", action="store_true")
+    parser.add_argument("--engine", help="formula: fill all histograms of one file in a single pass with TTree.Project expressions (default), project: one TTree.Project call per histogram, rdf: fill all histograms of one file in a single RDataFrame event loop", choices=["formula", "project", "rdf"], default="formula")
+    parser.add_argument("--bootstrap", help="Number of Poisson bootstrap replicas to fill for every template (requires --engine rdf)", type=int, default=0)
+    parser.add_argument("--bootstrap-seed", help="Seed for bootstrap replicas", type=int, default=0)
+    args = parser.parse_args()
+    if args.bootstrap > 0 and args.engine != "rdf": parser.error("--bootstrap requires --engine rdf")
+    if args.bootstrap > 0 and len(args.yamlpath) > 1: parser.error("--bootstrap requires a single spec")
+    if args.diagnosis and len(args.yamlpath) > 1: parser.error("--diagnosis requires a single spec")
+
+    yaml_specs = []
+    for yamlpath in args.yamlpath:
+        with open(yamlpath, "r") as yamlfile:
+            yaml_specs.append(yaml.safe_load(yamlfile))
+
+    if args.validate or not args.skip_validation:
+        validation_errors = []
+        for yamlpath, yaml_spec in zip(args.yamlpath, yaml_specs):
+            errors = validate_spec(yaml_spec)
+            if len(yaml_specs) > 1: errors = [f"{yamlpath}: {error}" for error in errors]
+            validation_errors += errors
+        print_report(validation_errors)
+        if validation_errors: raise SystemExit(1)
+        if args.validate: raise SystemExit(0)
+
+    # The same branch must not be added twice when several specs share input files
+    applied_perfileweights = set()
+    for yaml_spec in yaml_specs:
+        applied_perfileweights |= add_perfileweights(yaml_spec, read_settings(yaml_spec), skip=applied_perfileweights)
+    make_histograms_multi(
+        yaml_specs, diagnosis=args.diagnosis, engine=args.engine,
+        bootstrap=(args.bootstrap, args.bootstrap_seed) if args.bootstrap > 0 else None
+    )
 
-print("===========================")
-print("All done! :-)")
-print("See COMBINE_README.md for more info on combine script usage.")
\ No newline at end of file
+    print("===========================")
+    print("All done! :-)")
+    print("See COMBINE_README.md for more info on combine script usage.")
@@ -1,4 +1,5 @@
 import argparse
+import time
 import numpy as np
 import ROOT as pyr
 from matplotlib import pyplot as plt
@@ -31,351 +32,527 @@ def graph_to_array(graph):
     err = np.array(err).transpose()
     return res, err
 
-parser = argparse.ArgumentParser()
-parser.add_argument("yamlpath", help="input YAML file path, not the same as input for make_histograms.py")
-args = parser.parse_args()
+def errorbar_limits(y, yerr):
+    # Same convention as plt.errorbar: a 2xN yerr is (lower, upper)
+    yerr = np.asarray(yerr)
+    if yerr.ndim == 2: return y - yerr[0], y + yerr[1]
+    return y - yerr, y + yerr
 
-with open(args.yamlpath, "r") as yamlfile:
-    yaml_spec = yaml.safe_load(yamlfile)
+def update_errorbar(container, x, y, yerr):
+    # Moves the artists of an existing plt.errorbar container instead of drawing a new one
+    data_line, caplines, barlinecols = container.lines
+    y = np.asarray(y, dtype=float)
+    lower, upper = errorbar_limits(y, yerr)
+    if data_line is not None: data_line.set_data(x, y)
+    if len(caplines) == 2:
+        caplines[0].set_data(x, lower)
+        caplines[1].set_data(x, upper)
+    barlinecols[0].set_segments([[(xi, lo), (xi, hi)] for xi, lo, hi in zip(x, lower, upper)])
 
-def plot_prefit(array_mc, array_mc_error, array_mc_sum, array_data, array_data_err, histbins, legendtitle, filename):
-    fig = plt.figure(figsize=(12, 12), facecolor="white")
-    main_ax = plt.subplot2grid((5, 1), (0, 0), rowspan=4)
-    ratio_ax = plt.subplot2grid((5, 1), (4, 0))
-    fig.subplots_adjust(hspace=0)
-    
-    baseline = np.zeros(array_mc_sum.shape)
-    for category, category_config in yaml_spec["categories"].items():
-        main_ax.stairs(
-            array_mc[category] + baseline,
-            histbins,
-            baseline=baseline,
-            fill=True,
-            label=category_config["propername"],
-            facecolor=category_config["color"]
+def bin_centers(histbins):
+    return [(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)]
+
+def hide_first_ytick_label(ax):
+    # New ticks copy the properties of the first one, so labels hidden for a previous plot must be shown again first
+    ticks = ax.yaxis.get_major_ticks()
+    for tick in ticks: tick.label1.set_visible(True)
+    ticks[0].label1.set_visible(False)
+
+class PrefitFigure(object):
+    """
+    Stacked MC with data and Data/MC ratio, also used for control plots.
+    The figure, axes, styling and legend are built once, and only the artists' data are updated for every plot.
+    """
+    def __init__(self, yaml_spec):
+        self.yaml_spec = yaml_spec
+        self.fig = plt.figure(figsize=(12, 12), facecolor="white")
+        self.main_ax = plt.subplot2grid((5, 1), (0, 0), rowspan=4, fig=self.fig)
+        self.ratio_ax = plt.subplot2grid((5, 1), (4, 0), fig=self.fig)
+        self.fig.subplots_adjust(hspace=0)
+        main_ax, ratio_ax = self.main_ax, self.ratio_ax
+        
+        histbins = [0., 1.]
+        zeros = np.zeros(1)
+        self.mc_stairs = {}
+        self.mc_errorbars = {}
+        for category, category_config in yaml_spec["categories"].items():
+            self.mc_stairs[category] = main_ax.stairs(
+                zeros,
+                histbins,
+                baseline=zeros,
+                fill=True,
+                label=category_config["propername"],
+                facecolor=category_config["color"]
+            )
+            self.mc_errorbars[category] = main_ax.errorbar(
+                x=bin_centers(histbins),
+                y=zeros,
+                yerr=zeros,
+                fmt="none",
+                ecolor=category_config["color"],
+                capsize=5
+            )
+        self.data_errorbar = main_ax.errorbar(
+            x=bin_centers(histbins),
+            y=zeros,
+            yerr=zeros,
+            fmt="o",
+            color="black",
+            label="Data",
+            capsize=5
         )
-        main_ax.errorbar(
-            x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-            y=array_mc[category] + baseline,
-            yerr=array_mc_error[category],
-            fmt="none",
-            ecolor=category_config["color"],
+        
+        handles, labels = main_ax.get_legend_handles_labels()
+        order = [len(labels)-1] + list(range(len(labels)-1))
+        self.legend = main_ax.legend(
+            [handles[idx] for idx in order],
+            [labels[idx] for idx in order],
+            title=" "
+        )
+        
+        self.ratio_line = ratio_ax.hlines(1, 0, 1, linestyles="--", colors="#9c9ca1")
+        self.ratio_errorbar = ratio_ax.errorbar(
+            x=bin_centers(histbins),
+            y=zeros,
+            yerr=zeros,
+            fmt="o",
+            color="black",
             capsize=5
         )
-        baseline += array_mc[category]
-    main_ax.errorbar(
-        x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-        y=array_data,
-        yerr=array_data_err,
-        fmt="o",
-        color="black",
-        label="Data",
-        capsize=5
-    )
-    
-    handles, labels = main_ax.get_legend_handles_labels()
-    order = [len(labels)-1] + list(range(len(labels)-1))
-    main_ax.legend(
-        [handles[idx] for idx in order],
-        [labels[idx] for idx in order],
-        title=legendtitle
-    )
-    
-    ratio_ax.hlines(1, min(histbins), max(histbins), linestyles="--", colors="#9c9ca1")
-    ratio_ax.errorbar(
-        x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-        y=array_data/array_mc_sum,
-        yerr=array_data_err/array_mc_sum,
-        fmt="o",
-        color="black",
-        capsize=5
-    )
-    
-    main_ax.set_xlim((min(histbins), max(histbins)))
-    main_ax.set_ylim((0, max(array_mc_sum)*1.5))
-    main_ax.set_xticklabels([])
-    main_ax.yaxis.get_major_ticks()[0].label1.set_visible(False)
-    main_ax.set_ylabel("Events")
-    
-    ratio_ax.set_xlim((min(histbins), max(histbins)))
-    ratio_ax.set_ylim((0.75, 1.25))
-    ratio_ax.set_yticks((0.75, 1, 1.25))
-    ratio_ax.set_xlabel(yaml_spec["xlabel"])
-    ratio_ax.set_ylabel("Data/MC")
-    
-    hep.cms.label(
-        llabel="Preliminary",
-        lumi=yaml_spec["lumi"],
-        ax=main_ax,
-    )
+        
+        main_ax.set_xticklabels([])
+        main_ax.set_ylabel("Events")
+        ratio_ax.set_ylim((0.75, 1.25))
+        ratio_ax.set_yticks((0.75, 1, 1.25))
+        ratio_ax.set_ylabel("Data/MC")
+        
+        hep.cms.label(
+            llabel="Preliminary",
+            lumi=yaml_spec["lumi"],
+            ax=main_ax,
+        )
     
-    fig.savefig(filename, bbox_inches="tight")
+    def update(self, array_mc, array_mc_error, array_mc_sum, array_data, array_data_err, histbins, legendtitle, xlabel=None):
+        main_ax, ratio_ax = self.main_ax, self.ratio_ax
+        centers = bin_centers(histbins)
+        baseline = np.zeros(array_mc_sum.shape)
+        for category in self.yaml_spec["categories"].keys():
+            self.mc_stairs[category].set_data(array_mc[category] + baseline, histbins, baseline.copy())
+            update_errorbar(self.mc_errorbars[category], centers, array_mc[category] + baseline, array_mc_error[category])
+            baseline += array_mc[category]
+        update_errorbar(self.data_errorbar, centers, array_data, array_data_err)
+        self.legend.set_title(legendtitle)
+        
+        self.ratio_line.set_segments([[(min(histbins), 1), (max(histbins), 1)]])
+        update_errorbar(self.ratio_errorbar, centers, array_data/array_mc_sum, array_data_err/array_mc_sum)
+        
+        main_ax.set_xlim((min(histbins), max(histbins)))
+        main_ax.set_ylim((0, max(array_mc_sum)*1.5))
+        hide_first_ytick_label(main_ax)
+        ratio_ax.set_xlim((min(histbins), max(histbins)))
+        ratio_ax.set_xlabel(self.yaml_spec["xlabel"] if xlabel is None else xlabel)
 
-def plot_postfit(array_prefit_mc, array_prefit_mc_error, array_prefit_mc_sum, array_prefit_mc_sum_error, array_postfit_mc, array_postfit_mc_error, array_postfit_mc_sum, array_postfit_mc_sum_error, array_data, array_data_err, histbins, legendtitle, filename):
-    fig = plt.figure(figsize=(12, 12), facecolor="white")
-    main_ax = plt.subplot2grid((5, 1), (0, 0), rowspan=4)
-    ratio_ax = plt.subplot2grid((5, 1), (4, 0))
-    fig.subplots_adjust(hspace=0)
-    
-    for category, category_config in yaml_spec["categories"].items():
-        main_ax.stairs(
-            array_prefit_mc[category],
+class PostfitFigure(object):
+    """
+    Prefit (dotted) and postfit (solid) MC per category with data and Data/MC ratio.
+    The figure, axes, styling and legend are built once, and only the artists' data are updated for every plot.
+    """
+    def __init__(self, yaml_spec):
+        self.yaml_spec = yaml_spec
+        self.fig = plt.figure(figsize=(12, 12), facecolor="white")
+        self.main_ax = plt.subplot2grid((5, 1), (0, 0), rowspan=4, fig=self.fig)
+        self.ratio_ax = plt.subplot2grid((5, 1), (4, 0), fig=self.fig)
+        self.fig.subplots_adjust(hspace=0)
+        main_ax, ratio_ax = self.main_ax, self.ratio_ax
+        
+        histbins = [0., 1.]
+        zeros = np.zeros(1)
+        self.prefit_stairs = {}
+        self.prefit_errorbars = {}
+        self.postfit_stairs = {}
+        self.postfit_errorbars = {}
+        for category, category_config in yaml_spec["categories"].items():
+            self.prefit_stairs[category] = main_ax.stairs(
+                zeros,
+                histbins,
+                fill=False,
+                color=category_config["color"],
+                linestyle=":",
+                linewidth=2
+            )
+            self.prefit_errorbars[category] = main_ax.errorbar(
+                x=bin_centers(histbins),
+                y=zeros,
+                yerr=zeros,
+                fmt="none",
+                ecolor=category_config["color"],
+                linestyle=":",
+                linewidth=2
+            )
+            self.prefit_errorbars[category][-1][0].set_linestyle(":")
+            self.postfit_stairs[category] = main_ax.stairs(
+                zeros,
+                histbins,
+                fill=False,
+                label=category_config["propername"],
+                color=category_config["color"],
+                linestyle="-",
+                linewidth=2
+            )
+            self.postfit_errorbars[category] = main_ax.errorbar(
+                x=bin_centers(histbins),
+                y=zeros,
+                yerr=zeros,
+                fmt="none",
+                ecolor=category_config["color"],
+                linestyle="-",
+                capsize=5,
+                linewidth=2
+            )
+        
+        self.prefit_sum_stairs = main_ax.stairs(
+            zeros,
             histbins,
             fill=False,
-            color=category_config["color"],
+            color="#717581",
+            label="Prefit",
             linestyle=":",
             linewidth=2
         )
-        prefit_errbar = main_ax.errorbar(
-            x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-            y=array_prefit_mc[category],
-            yerr=array_prefit_mc_error[category],
+        self.prefit_sum_errorbar = main_ax.errorbar(
+            x=bin_centers(histbins),
+            y=zeros,
+            yerr=zeros,
             fmt="none",
-            ecolor=category_config["color"],
+            ecolor="#717581",
             linestyle=":",
             linewidth=2
         )
-        prefit_errbar[-1][0].set_linestyle(":")
-        main_ax.stairs(
-            array_postfit_mc[category],
+        self.prefit_sum_errorbar[-1][0].set_linestyle(":")
+        self.postfit_sum_stairs = main_ax.stairs(
+            zeros,
             histbins,
             fill=False,
-            label=category_config["propername"],
-            color=category_config["color"],
+            label="Total SM",
+            color="#717581",
             linestyle="-",
             linewidth=2
         )
-        main_ax.errorbar(
-            x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-            y=array_postfit_mc[category],
-            yerr=array_postfit_mc_error[category],
-            fmt="none",
-            ecolor=category_config["color"],
-            linestyle="-",
+        self.postfit_unc_stairs = main_ax.stairs(
+            zeros,
+            histbins,
+            baseline=zeros,
+            fill=False,
+            label="Postfit unc.",
+            color="#717581",
+            hatch="///",
+            linewidth=0
+        )
+        
+        self.data_errorbar = main_ax.errorbar(
+            x=bin_centers(histbins),
+            y=zeros,
+            yerr=zeros,
+            fmt="o",
+            color="black",
+            label="Data",
             capsize=5,
             linewidth=2
         )
+        
+        handles, labels = main_ax.get_legend_handles_labels()
+        order = [len(labels)-1] + list(range(len(labels)-4)) + [len(labels)-3, len(labels)-2, len(labels)-4]
+        self.legend = main_ax.legend(
+            [handles[idx] for idx in order],
+            [labels[idx] for idx in order],
+            title=" "
+        )
+        
+        self.ratio_line = ratio_ax.hlines(1, 0, 1, linestyles="--", colors="#9c9ca1")
+        self.ratio_unc_stairs = ratio_ax.stairs(
+            zeros,
+            histbins,
+            baseline=zeros,
+            fill=False,
+            label="Postfit unc.",
+            color="black",
+            hatch="///",
+            linewidth=0
+        )
+        self.ratio_errorbar = ratio_ax.errorbar(
+            x=bin_centers(histbins),
+            y=zeros,
+            yerr=zeros,
+            fmt="o",
+            color="black",
+            capsize=5
+        )
+        
+        main_ax.set_xticklabels([])
+        main_ax.set_ylabel("Events")
+        ratio_ax.set_ylim((0.75, 1.25))
+        ratio_ax.set_yticks((0.75, 1, 1.25))
+        ratio_ax.set_xlabel(yaml_spec["xlabel"])
+        ratio_ax.set_ylabel("Data/MC")
+        
+        hep.cms.label(
+            llabel="Preliminary",
+            lumi=yaml_spec["lumi"],
+            ax=main_ax,
+        )
     
-    main_ax.stairs(
-        array_prefit_mc_sum,
-        histbins,
-        fill=False,
-        color="#717581",
-        label="Prefit",
-        linestyle=":",
-        linewidth=2
-    )
-    total_prefit_errbar = main_ax.errorbar(
-        x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-        y=array_prefit_mc_sum,
-        yerr=array_prefit_mc_sum_error,
-        fmt="none",
-        ecolor="#717581",
-        linestyle=":",
-        linewidth=2
-    )
-    total_prefit_errbar[-1][0].set_linestyle(":")
-    main_ax.stairs(
-        array_postfit_mc_sum,
-        histbins,
-        fill=False,
-        label="Total SM",
-        color="#717581",
-        linestyle="-",
-        linewidth=2
-    )
-    main_ax.stairs(
-        array_postfit_mc_sum+array_postfit_mc_sum_error[0],
-        histbins,
-        baseline=array_postfit_mc_sum-array_postfit_mc_sum_error[1],
-        fill=False,
-        label="Postfit unc.",
-        color="#717581",
-        hatch="///",
-        linewidth=0
-    )
-    
-    main_ax.errorbar(
-        x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-        y=array_data,
-        yerr=array_data_err,
-        fmt="o",
-        color="black",
-        label="Data",
-        capsize=5,
-        linewidth=2
-    )
-    
-    handles, labels = main_ax.get_legend_handles_labels()
-    order = [len(labels)-1] + list(range(len(labels)-4)) + [len(labels)-3, len(labels)-2, len(labels)-4]
-    main_ax.legend(
-        [handles[idx] for idx in order],
-        [labels[idx] for idx in order],
-        title=legendtitle
-    )
-    
-    ratio_ax.hlines(1, min(histbins), max(histbins), linestyles="--", colors="#9c9ca1")
-    ratio_ax.stairs(
-        (array_postfit_mc_sum+array_postfit_mc_sum_error[0])/array_postfit_mc_sum,
-        histbins,
-        baseline=(array_postfit_mc_sum-array_postfit_mc_sum_error[1])/array_postfit_mc_sum,
-        fill=False,
-        label="Postfit unc.",
-        color="black",
-        hatch="///",
-        linewidth=0
-    )
-    ratio_ax.errorbar(
-        x=[(histbins[i]+histbins[i+1])/2 for i in range(len(histbins)-1)],
-        y=array_data/array_postfit_mc_sum,
-        yerr=array_data_err/array_postfit_mc_sum,
-        fmt="o",
-        color="black",
-        capsize=5
-    )
+    def update(self, array_prefit_mc, array_prefit_mc_error, array_prefit_mc_sum, array_prefit_mc_sum_error, array_postfit_mc, array_postfit_mc_error, array_postfit_mc_sum, array_postfit_mc_sum_error, array_data, array_data_err, histbins, legendtitle):
+        main_ax, ratio_ax = self.main_ax, self.ratio_ax
+        centers = bin_centers(histbins)
+        for category in self.yaml_spec["categories"].keys():
+            self.prefit_stairs[category].set_data(array_prefit_mc[category], histbins)
+            update_errorbar(self.prefit_errorbars[category], centers, array_prefit_mc[category], array_prefit_mc_error[category])
+            self.postfit_stairs[category].set_data(array_postfit_mc[category], histbins)
+            update_errorbar(self.postfit_errorbars[category], centers, array_postfit_mc[category], array_postfit_mc_error[category])
+        
+        self.prefit_sum_stairs.set_data(array_prefit_mc_sum, histbins)
+        update_errorbar(self.prefit_sum_errorbar, centers, array_prefit_mc_sum, array_prefit_mc_sum_error)
+        self.postfit_sum_stairs.set_data(array_postfit_mc_sum, histbins)
+        self.postfit_unc_stairs.set_data(
+            array_postfit_mc_sum+array_postfit_mc_sum_error[0],
+            histbins,
+            array_postfit_mc_sum-array_postfit_mc_sum_error[1]
+        )
+        update_errorbar(self.data_errorbar, centers, array_data, array_data_err)
+        self.legend.set_title(legendtitle)
+        
+        self.ratio_line.set_segments([[(min(histbins), 1), (max(histbins), 1)]])
+        self.ratio_unc_stairs.set_data(
+            (array_postfit_mc_sum+array_postfit_mc_sum_error[0])/array_postfit_mc_sum,
+            histbins,
+            (array_postfit_mc_sum-array_postfit_mc_sum_error[1])/array_postfit_mc_sum
+        )
+        update_errorbar(self.ratio_errorbar, centers, array_data/array_postfit_mc_sum, array_data_err/array_postfit_mc_sum)
+        
+        main_ax.set_xlim((min(histbins), max(histbins)))
+        main_ax.set_ylim((0, max(array_postfit_mc_sum)*1.5))
+        hide_first_ytick_label(main_ax)
+        ratio_ax.set_xlim((min(histbins), max(histbins)))
+
+class Renderer(object):
+    """
+    Keeps one figure per plot type, which is reused for every event category and closed in close().
+    Each plot is saved in all formats listed in the YAML file (key formats, default [png]), and its render time is recorded.
+    """
+    def __init__(self, yaml_spec):
+        self.yaml_spec = yaml_spec
+        self.formats = yaml_spec.get("formats", ["png"])
+        self.dpi = yaml_spec.get("dpi", "figure")
+        self.figures = {}
+        self.render_times = {}
     
-    main_ax.set_xlim((min(histbins), max(histbins)))
-    main_ax.set_ylim((0, max(array_postfit_mc_sum)*1.5))
-    main_ax.set_xticklabels([])
-    main_ax.yaxis.get_major_ticks()[0].label1.set_visible(False)
-    main_ax.set_ylabel("Events")
+    def figure(self, plottype):
+        if plottype not in self.figures.keys():
+            if plottype == "prefit": self.figures[plottype] = PrefitFigure(self.yaml_spec)
+            elif plottype == "postfit": self.figures[plottype] = PostfitFigure(self.yaml_spec)
+        return self.figures[plottype]
     
-    ratio_ax.set_xlim((min(histbins), max(histbins)))
-    ratio_ax.set_ylim((0.75, 1.25))
-    ratio_ax.set_yticks((0.75, 1, 1.25))
-    ratio_ax.set_xlabel(yaml_spec["xlabel"])
-    ratio_ax.set_ylabel("Data/MC")
+    def render(self, plottype, basename, *args, **kwargs):
+        # basename: output path without extension
+        start = time.perf_counter()
+        figure = self.figure(plottype)
+        figure.update(*args, **kwargs)
+        for fmt in self.formats:
+            figure.fig.savefig(f"{basename}.{fmt}", bbox_inches="tight", dpi=self.dpi)
+        render_time = time.perf_counter() - start
+        self.render_times[basename] = render_time
+        print(f"Saved {basename}.{{{','.join(self.formats)}}} in {render_time:.3f} s")
     
-    hep.cms.label(
-        llabel="Preliminary",
-        lumi=yaml_spec["lumi"],
-        ax=main_ax,
-    )
+    def print_summary(self):
+        if not self.render_times: return
+        render_times = list(self.render_times.values())
+        print("===========================")
+        print(f"Rendered {len(render_times)} figures in {sum(render_times):.3f} s, mean {np.mean(render_times):.3f} s, max {max(render_times):.3f} s")
     
-    fig.savefig(filename, bbox_inches="tight")
+    def close(self):
+        for figure in self.figures.values(): plt.close(figure.fig)
+        self.figures = {}
 
-for eventcat in yaml_spec["eventcats"]:
+def plot_controls(yaml_spec, eventcat, renderer):
+    # Stacked data/MC plots of the extra variables filled by make_histograms.py, one per variable and pass/fail
     eventcat_name = eventcat["name"]
     if "propername" in eventcat.keys(): ptrange_propername = eventcat["propername"]
     else: ptrange_propername = eventcat_name
-    prefitfile  = pyr.TFile(eventcat["prefitfile"])
-    postfitfile = pyr.TFile(eventcat["postfitfile"])
+    if "controlfile" in eventcat.keys(): controlfile = pyr.TFile(eventcat["controlfile"])
+    else: controlfile = pyr.TFile(eventcat["prefitfile"].replace(".root", "_controls.root"))
+    
+    for control in yaml_spec["controls"]:
+        varname = control["name"]
+        for passing in ["pass", "fail"]:
+            array_data, array_data_err = hist_to_array(controlfile.Get(f"data_{eventcat_name}_{passing}_{varname}"), isData=True)
+            array_mc = {}
+            array_mc_error = {}
+            for category in yaml_spec["categories"].keys():
+                hist_mc = controlfile.Get(f"{category}_{eventcat_name}_{passing}_{varname}")
+                array_mc[category], array_mc_error[category] = hist_to_array(hist_mc)
+            array_mc_sum = sum(array_mc.values())
+            renderer.render(
+                "prefit",
+                f"{yaml_spec['savedir']}/control_{varname}_{passing}_{eventcat_name}",
+                array_mc, 
+                array_mc_error, 
+                array_mc_sum, 
+                array_data, 
+                array_data_err, 
+                hist_to_bins(hist_mc), 
+                ptrange_propername + ", " + passing, 
+                xlabel=control["xlabel"] if "xlabel" in control.keys() else varname
+            )
+    controlfile.Close()
+
+def plot_histograms(yaml_spec, eventcats=None):
+    # eventcats: names of event categories to plot, all event categories in the YAML file if None
+    renderer = Renderer(yaml_spec)
+    try:
+        plot_eventcats(yaml_spec, renderer, eventcats)
+    finally:
+        renderer.close()
+    renderer.print_summary()
+
+def plot_eventcats(yaml_spec, renderer, eventcats=None):
+    for eventcat in yaml_spec["eventcats"]:
+        if eventcats is not None and eventcat["name"] not in eventcats: continue
+        eventcat_name = eventcat["name"]
+        if "propername" in eventcat.keys(): ptrange_propername = eventcat["propername"]
+        else: ptrange_propername = eventcat_name
+        prefitfile  = pyr.TFile(eventcat["prefitfile"])
+        postfitfile = pyr.TFile(eventcat["postfitfile"])
     
-    hist_prefit_data_pass = prefitfile.Get(f"data_{eventcat_name}_pass")
-    hist_prefit_data_fail = prefitfile.Get(f"data_{eventcat_name}_fail")
-    hist_prefit_mc_pass = {}
-    hist_prefit_mc_fail = {}
-    for category in yaml_spec["categories"].keys():
-        hist_prefit_mc_pass[category] = prefitfile.Get(f"{category}_{eventcat_name}_pass_nominal")
-        hist_prefit_mc_fail[category] = prefitfile.Get(f"{category}_{eventcat_name}_fail_nominal")
-    hist_prefit_mc_pass_sum = hist_prefit_mc_pass[list(yaml_spec["categories"].keys())[0]].Clone(f"total_{eventcat_name}_pass_nominal")
-    hist_prefit_mc_fail_sum = hist_prefit_mc_fail[list(yaml_spec["categories"].keys())[0]].Clone(f"total_{eventcat_name}_fail_nominal")
-    hist_prefit_mc_pass_sum.Reset("ICES")
-    hist_prefit_mc_fail_sum.Reset("ICES")
-    for category in yaml_spec["categories"].keys():
-        hist_prefit_mc_pass_sum.Add(hist_prefit_mc_pass[category])
-        hist_prefit_mc_fail_sum.Add(hist_prefit_mc_fail[category])
+        hist_prefit_data_pass = prefitfile.Get(f"data_{eventcat_name}_pass")
+        hist_prefit_data_fail = prefitfile.Get(f"data_{eventcat_name}_fail")
+        hist_prefit_mc_pass = {}
+        hist_prefit_mc_fail = {}
+        for category in yaml_spec["categories"].keys():
+            hist_prefit_mc_pass[category] = prefitfile.Get(f"{category}_{eventcat_name}_pass_nominal")
+            hist_prefit_mc_fail[category] = prefitfile.Get(f"{category}_{eventcat_name}_fail_nominal")
+        hist_prefit_mc_pass_sum = hist_prefit_mc_pass[list(yaml_spec["categories"].keys())[0]].Clone(f"total_{eventcat_name}_pass_nominal")
+        hist_prefit_mc_fail_sum = hist_prefit_mc_fail[list(yaml_spec["categories"].keys())[0]].Clone(f"total_{eventcat_name}_fail_nominal")
+        hist_prefit_mc_pass_sum.Reset("ICES")
+        hist_prefit_mc_fail_sum.Reset("ICES")
+        for category in yaml_spec["categories"].keys():
+            hist_prefit_mc_pass_sum.Add(hist_prefit_mc_pass[category])
+            hist_prefit_mc_fail_sum.Add(hist_prefit_mc_fail[category])
     
-    hist_postfit_data_pass = postfitfile.Get(f"shapes_prefit/pass/data")
-    hist_postfit_data_fail = postfitfile.Get(f"shapes_prefit/fail/data")
-    hist_postfit_mc_pass = {}
-    hist_postfit_mc_fail = {}
-    hist_postfit_mc_pass_prefit = {}
-    hist_postfit_mc_fail_prefit = {}
-    for category in yaml_spec["categories"].keys():
-        hist_postfit_mc_pass[category] = postfitfile.Get(f"shapes_fit_s/pass/{category}")
-        hist_postfit_mc_fail[category] = postfitfile.Get(f"shapes_fit_s/fail/{category}")
-        hist_postfit_mc_pass_prefit[category] = postfitfile.Get(f"shapes_prefit/pass/{category}")
-        hist_postfit_mc_fail_prefit[category] = postfitfile.Get(f"shapes_prefit/fail/{category}")
-    hist_postfit_mc_pass_sum = postfitfile.Get("shapes_fit_s/pass/total")
-    hist_postfit_mc_fail_sum = postfitfile.Get("shapes_fit_s/fail/total")
-    hist_postfit_mc_pass_prefit_sum = postfitfile.Get("shapes_prefit/pass/total")
-    hist_postfit_mc_fail_prefit_sum = postfitfile.Get("shapes_prefit/fail/total")
+        hist_postfit_data_pass = postfitfile.Get(f"shapes_prefit/pass/data")
+        hist_postfit_data_fail = postfitfile.Get(f"shapes_prefit/fail/data")
+        hist_postfit_mc_pass = {}
+        hist_postfit_mc_fail = {}
+        hist_postfit_mc_pass_prefit = {}
+        hist_postfit_mc_fail_prefit = {}
+        for category in yaml_spec["categories"].keys():
+            hist_postfit_mc_pass[category] = postfitfile.Get(f"shapes_fit_s/pass/{category}")
+            hist_postfit_mc_fail[category] = postfitfile.Get(f"shapes_fit_s/fail/{category}")
+            hist_postfit_mc_pass_prefit[category] = postfitfile.Get(f"shapes_prefit/pass/{category}")
+            hist_postfit_mc_fail_prefit[category] = postfitfile.Get(f"shapes_prefit/fail/{category}")
+        hist_postfit_mc_pass_sum = postfitfile.Get("shapes_fit_s/pass/total")
+        hist_postfit_mc_fail_sum = postfitfile.Get("shapes_fit_s/fail/total")
+        hist_postfit_mc_pass_prefit_sum = postfitfile.Get("shapes_prefit/pass/total")
+        hist_postfit_mc_fail_prefit_sum = postfitfile.Get("shapes_prefit/fail/total")
     
-    array_prefit_data_pass, array_prefit_data_pass_err = hist_to_array(hist_prefit_data_pass, isData=True)
-    array_prefit_data_fail, array_prefit_data_fail_err = hist_to_array(hist_prefit_data_fail, isData=True)
-    array_prefit_mc_pass = {}
-    array_prefit_mc_fail = {}
-    array_prefit_mc_pass_error = {}
-    array_prefit_mc_fail_error = {}
-    for category in yaml_spec["categories"].keys():
-        array_prefit_mc_pass[category], array_prefit_mc_pass_error[category] = hist_to_array(hist_prefit_mc_pass[category])
-        array_prefit_mc_fail[category], array_prefit_mc_fail_error[category] = hist_to_array(hist_prefit_mc_fail[category])
-    array_prefit_mc_pass_sum, array_prefit_mc_pass_sum_err = hist_to_array(hist_prefit_mc_pass_sum)
-    array_prefit_mc_fail_sum, array_prefit_mc_fail_sum_err = hist_to_array(hist_prefit_mc_fail_sum)
+        array_prefit_data_pass, array_prefit_data_pass_err = hist_to_array(hist_prefit_data_pass, isData=True)
+        array_prefit_data_fail, array_prefit_data_fail_err = hist_to_array(hist_prefit_data_fail, isData=True)
+        array_prefit_mc_pass = {}
+        array_prefit_mc_fail = {}
+        array_prefit_mc_pass_error = {}
+        array_prefit_mc_fail_error = {}
+        for category in yaml_spec["categories"].keys():
+            array_prefit_mc_pass[category], array_prefit_mc_pass_error[category] = hist_to_array(hist_prefit_mc_pass[category])
+            array_prefit_mc_fail[category], array_prefit_mc_fail_error[category] = hist_to_array(hist_prefit_mc_fail[category])
+        array_prefit_mc_pass_sum, array_prefit_mc_pass_sum_err = hist_to_array(hist_prefit_mc_pass_sum)
+        array_prefit_mc_fail_sum, array_prefit_mc_fail_sum_err = hist_to_array(hist_prefit_mc_fail_sum)
     
-    array_postfit_data_pass, array_postfit_data_pass_err = graph_to_array(hist_postfit_data_pass)
-    array_postfit_data_fail, array_postfit_data_fail_err = graph_to_array(hist_postfit_data_fail)
-    array_postfit_mc_pass = {}
-    array_postfit_mc_fail = {}
-    array_postfit_mc_pass_err = {}
-    array_postfit_mc_fail_err = {}
-    array_postfit_mc_pass_prefit = {}
-    array_postfit_mc_fail_prefit = {}
-    array_postfit_mc_pass_prefit_err = {}
-    array_postfit_mc_fail_prefit_err = {}
-    for category in yaml_spec["categories"].keys():
-        array_postfit_mc_pass[category], array_postfit_mc_pass_err[category] = hist_to_array(hist_postfit_mc_pass[category])
-        array_postfit_mc_fail[category], array_postfit_mc_fail_err[category] = hist_to_array(hist_postfit_mc_fail[category])
-        array_postfit_mc_pass_prefit[category], array_postfit_mc_pass_prefit_err[category] = hist_to_array(hist_postfit_mc_pass_prefit[category])
-        array_postfit_mc_fail_prefit[category], array_postfit_mc_fail_prefit_err[category] = hist_to_array(hist_postfit_mc_fail_prefit[category])
-    array_postfit_mc_pass_sum, array_postfit_mc_pass_sum_err = hist_to_array(hist_postfit_mc_pass_sum)
-    array_postfit_mc_fail_sum, array_postfit_mc_fail_sum_err = hist_to_array(hist_postfit_mc_fail_sum)
-    array_postfit_mc_pass_prefit_sum, array_postfit_mc_pass_prefit_sum_err = hist_to_array(hist_postfit_mc_pass_prefit_sum)
-    array_postfit_mc_fail_prefit_sum, array_postfit_mc_fail_prefit_sum_err = hist_to_array(hist_postfit_mc_fail_prefit_sum)
+        array_postfit_data_pass, array_postfit_data_pass_err = graph_to_array(hist_postfit_data_pass)
+        array_postfit_data_fail, array_postfit_data_fail_err = graph_to_array(hist_postfit_data_fail)
+        array_postfit_mc_pass = {}
+        array_postfit_mc_fail = {}
+        array_postfit_mc_pass_err = {}
+        array_postfit_mc_fail_err = {}
+        array_postfit_mc_pass_prefit = {}
+        array_postfit_mc_fail_prefit = {}
+        array_postfit_mc_pass_prefit_err = {}
+        array_postfit_mc_fail_prefit_err = {}
+        for category in yaml_spec["categories"].keys():
+            array_postfit_mc_pass[category], array_postfit_mc_pass_err[category] = hist_to_array(hist_postfit_mc_pass[category])
+            array_postfit_mc_fail[category], array_postfit_mc_fail_err[category] = hist_to_array(hist_postfit_mc_fail[category])
+            array_postfit_mc_pass_prefit[category], array_postfit_mc_pass_prefit_err[category] = hist_to_array(hist_postfit_mc_pass_prefit[category])
+            array_postfit_mc_fail_prefit[category], array_postfit_mc_fail_prefit_err[category] = hist_to_array(hist_postfit_mc_fail_prefit[category])
+        array_postfit_mc_pass_sum, array_postfit_mc_pass_sum_err = hist_to_array(hist_postfit_mc_pass_sum)
+        array_postfit_mc_fail_sum, array_postfit_mc_fail_sum_err = hist_to_array(hist_postfit_mc_fail_sum)
+        array_postfit_mc_pass_prefit_sum, array_postfit_mc_pass_prefit_sum_err = hist_to_array(hist_postfit_mc_pass_prefit_sum)
+        array_postfit_mc_fail_prefit_sum, array_postfit_mc_fail_prefit_sum_err = hist_to_array(hist_postfit_mc_fail_prefit_sum)
     
-    histbins_prefit_pass = hist_to_bins(hist_prefit_mc_pass_sum)
-    histbins_prefit_fail = hist_to_bins(hist_prefit_mc_fail_sum)
-    histbins_postfit_pass = hist_to_bins(hist_postfit_mc_pass_sum)
-    histbins_postfit_fail = hist_to_bins(hist_postfit_mc_fail_sum)
+        histbins_prefit_pass = hist_to_bins(hist_prefit_mc_pass_sum)
+        histbins_prefit_fail = hist_to_bins(hist_prefit_mc_fail_sum)
+        histbins_postfit_pass = hist_to_bins(hist_postfit_mc_pass_sum)
+        histbins_postfit_fail = hist_to_bins(hist_postfit_mc_fail_sum)
     
-    plot_prefit(
-        array_prefit_mc_pass, 
-        array_prefit_mc_pass_error, 
-        array_prefit_mc_pass_sum, 
-        array_prefit_data_pass, 
-        array_prefit_data_pass_err, 
-        histbins_prefit_pass, 
-        ptrange_propername + ", pass", 
-        f"{yaml_spec['savedir']}/prefit_pass_{eventcat_name}.png"
-    )
-    plot_prefit(
-        array_prefit_mc_fail, 
-        array_prefit_mc_fail_error, 
-        array_prefit_mc_fail_sum, 
-        array_prefit_data_fail, 
-        array_prefit_data_fail_err, 
-        histbins_prefit_fail, 
-        ptrange_propername + ", fail", 
-        f"{yaml_spec['savedir']}/prefit_fail_{eventcat_name}.png"
-    )
-    plot_postfit(
-        array_postfit_mc_pass_prefit, 
-        array_postfit_mc_pass_prefit_err, 
-        array_postfit_mc_pass_prefit_sum, 
-        array_postfit_mc_pass_prefit_sum_err, 
-        array_postfit_mc_pass, 
-        array_postfit_mc_pass_err, 
-        array_postfit_mc_pass_sum, 
-        array_postfit_mc_pass_sum_err, 
-        array_postfit_data_pass, 
-        array_postfit_data_pass_err, 
-        histbins_prefit_pass,
-        ptrange_propername + ", pass", 
-        f"{yaml_spec['savedir']}/postfit_pass_{eventcat_name}.png"
-    )
-    plot_postfit(
-        array_postfit_mc_fail_prefit, 
-        array_postfit_mc_fail_prefit_err, 
-        array_postfit_mc_fail_prefit_sum, 
-        array_postfit_mc_fail_prefit_sum_err, 
-        array_postfit_mc_fail, 
-        array_postfit_mc_fail_err, 
-        array_postfit_mc_fail_sum, 
-        array_postfit_mc_fail_sum_err, 
-        array_postfit_data_fail, 
-        array_postfit_data_fail_err, 
-        histbins_prefit_fail,
-        ptrange_propername + ", fail", 
-        f"{yaml_spec['savedir']}/postfit_fail_{eventcat_name}.png"
-    )
\ No newline at end of file
+        renderer.render(
+            "prefit",
+            f"{yaml_spec['savedir']}/prefit_pass_{eventcat_name}",
+            array_prefit_mc_pass, 
+            array_prefit_mc_pass_error, 
+            array_prefit_mc_pass_sum, 
+            array_prefit_data_pass, 
+            array_prefit_data_pass_err, 
+            histbins_prefit_pass, 
+            ptrange_propername + ", pass"
+        )
+        renderer.render(
+            "prefit",
+            f"{yaml_spec['savedir']}/prefit_fail_{eventcat_name}",
+            array_prefit_mc_fail, 
+            array_prefit_mc_fail_error, 
+            array_prefit_mc_fail_sum, 
+            array_prefit_data_fail, 
+            array_prefit_data_fail_err, 
+            histbins_prefit_fail, 
+            ptrange_propername + ", fail"
+        )
+        renderer.render(
+            "postfit",
+            f"{yaml_spec['savedir']}/postfit_pass_{eventcat_name}",
+            array_postfit_mc_pass_prefit, 
+            array_postfit_mc_pass_prefit_err, 
+            array_postfit_mc_pass_prefit_sum, 
+            array_postfit_mc_pass_prefit_sum_err, 
+            array_postfit_mc_pass, 
+            array_postfit_mc_pass_err, 
+            array_postfit_mc_pass_sum, 
+            array_postfit_mc_pass_sum_err, 
+            array_postfit_data_pass, 
+            array_postfit_data_pass_err, 
+            histbins_prefit_pass,
+            ptrange_propername + ", pass"
+        )
+        renderer.render(
+            "postfit",
+            f"{yaml_spec['savedir']}/postfit_fail_{eventcat_name}",
+            array_postfit_mc_fail_prefit, 
+            array_postfit_mc_fail_prefit_err, 
+            array_postfit_mc_fail_prefit_sum, 
+            array_postfit_mc_fail_prefit_sum_err, 
+            array_postfit_mc_fail, 
+            array_postfit_mc_fail_err, 
+            array_postfit_mc_fail_sum, 
+            array_postfit_mc_fail_sum_err, 
+            array_postfit_data_fail, 
+            array_postfit_data_fail_err, 
+            histbins_prefit_fail,
+            ptrange_propername + ", fail"
+        )
+        if "controls" in yaml_spec.keys(): plot_controls(yaml_spec, eventcat, renderer)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="input YAML file path, not the same as input for make_histograms.py")
+    args = parser.parse_args()
+
+    with open(args.yamlpath, "r") as yamlfile:
+        yaml_spec = yaml.safe_load(yamlfile)
+
+    plot_histograms(yaml_spec)
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import socket
+import time
+import traceback
+import numpy as np
+import yaml
+import make_histograms as mh
+import plot_histograms as ph
+from validate_spec import validate_spec, print_report
+
+DEFAULT_SOCKET = "topsf_serve.sock"
+
+class TopSFServer(object):
+    """
+    Long-lived process keeping ROOT, mplhep, open input files and filled histograms in memory between reruns.
+    Requests are JSON lines sent over a Unix socket, one request and one response per connection.
+    """
+    def __init__(self, socket_path, watch_make=None, watch_plot=None, cache_size=None):
+        self.socket_path = socket_path
+        self.watched = {}
+        if watch_make is not None: self.watched[os.path.abspath(watch_make)] = "make"
+        if watch_plot is not None: self.watched[os.path.abspath(watch_plot)] = "plot"
+        self.watched_mtime = {}
+        self.latencies = {}
+        self.applied_perfileweights = set()
+        self.validated_specs = {}
+        self.plot_signatures = {}
+        mh.HISTOGRAM_CACHE = mh.HistogramCache(max_histograms=cache_size)
+
+    def load_spec(self, specpath):
+        with open(specpath, "r") as yamlfile:
+            spec_text = yamlfile.read()
+        return spec_text, yaml.safe_load(spec_text)
+
+    def run_make(self, specpath, diagnosis=False, engine="formula"):
+        spec_text, yaml_spec = self.load_spec(specpath)
+        # Validation only needs to run again when the spec changes
+        if self.validated_specs.get(specpath) != spec_text:
+            validation_errors = validate_spec(yaml_spec)
+            print_report(validation_errors)
+            if validation_errors: return {"status": "error", "message": "spec validation failed", "errors": validation_errors}
+            self.validated_specs[specpath] = spec_text
+        settings = mh.read_settings(yaml_spec)
+        self.applied_perfileweights |= mh.add_perfileweights(yaml_spec, settings, skip=self.applied_perfileweights)
+        hits, misses = mh.HISTOGRAM_CACHE.hits, mh.HISTOGRAM_CACHE.misses
+        analysis_obj_collection = mh.make_histograms(yaml_spec, diagnosis=diagnosis, engine=engine)
+        return {
+            "status": "ok",
+            "event_categories": list(analysis_obj_collection.keys()),
+            "histograms_reused": mh.HISTOGRAM_CACHE.hits - hits,
+            "histograms_filled": mh.HISTOGRAM_CACHE.misses - misses,
+        }
+
+    def plot_signature(self, yaml_spec, eventcat):
+        # A plot only needs redrawing if its config, the global plot config, or one of its input files changed
+        global_config = {key: value for key, value in yaml_spec.items() if key != "eventcats"}
+        inputs = [eventcat["prefitfile"], eventcat["postfitfile"]]
+        if "controls" in yaml_spec.keys(): inputs.append(eventcat.get("controlfile", eventcat["prefitfile"].replace(".root", "_controls.root")))
+        mtimes = [os.path.getmtime(path) if os.path.exists(path) else None for path in inputs]
+        return json.dumps([global_config, eventcat, mtimes], sort_keys=True)
+
+    def run_plot(self, specpath):
+        _, yaml_spec = self.load_spec(specpath)
+        signatures = {eventcat["name"]: self.plot_signature(yaml_spec, eventcat) for eventcat in yaml_spec["eventcats"]}
+        changed = [name for name, signature in signatures.items() if self.plot_signatures.get((specpath, name)) != signature]
+        if changed: ph.plot_histograms(yaml_spec, eventcats=changed)
+        for name in changed: self.plot_signatures[(specpath, name)] = signatures[name]
+        return {"status": "ok", "replotted": changed, "unchanged": [name for name in signatures.keys() if name not in changed]}
+
+    def stats(self):
+        result = {"status": "ok", "latency": {}}
+        for command, latencies in self.latencies.items():
+            result["latency"][command] = {
+                "count": len(latencies),
+                "last": latencies[-1],
+                "mean": float(np.mean(latencies)),
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "max": float(np.max(latencies)),
+            }
+        result["cache"] = {
+            "histograms": len(mh.HISTOGRAM_CACHE.hists),
+            "max_histograms": mh.HISTOGRAM_CACHE.max_histograms,
+            "open_files": len(mh.HISTOGRAM_CACHE.files),
+            "hits": mh.HISTOGRAM_CACHE.hits,
+            "misses": mh.HISTOGRAM_CACHE.misses,
+        }
+        return result
+
+    def handle(self, request):
+        command = request.get("command")
+        start = time.perf_counter()
+        try:
+            if command == "make": response = self.run_make(request["spec"], diagnosis=request.get("diagnosis", False), engine=request.get("engine", "formula"))
+            elif command == "plot": response = self.run_plot(request["spec"])
+            elif command == "stats": return self.stats()
+            elif command == "shutdown": return {"status": "ok"}
+            else: return {"status": "error", "message": f"unknown command {command}"}
+        except Exception as error:
+            traceback.print_exc()
+            response = {"status": "error", "message": f"{type(error).__name__}: {error}"}
+        latency = time.perf_counter() - start
+        self.latencies.setdefault(command, []).append(latency)
+        response["latency"] = latency
+        print(f"Request {command} done in {latency:.3f} s")
+        return response
+
+    def check_watched(self):
+        for specpath, command in self.watched.items():
+            if not os.path.exists(specpath): continue
+            mtime = os.path.getmtime(specpath)
+            if self.watched_mtime.get(specpath) == mtime: continue
+            self.watched_mtime[specpath] = mtime
+            print(f"Spec {specpath} changed, running {command}")
+            self.handle({"command": command, "spec": specpath})
+
+    def serve(self):
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        server.settimeout(1.)
+        print(f"Serving on {self.socket_path}")
+        try:
+            while True:
+                self.check_watched()
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                request = {}
+                with connection:
+                    # A bad request or a client going away must not take the server and its caches down
+                    try:
+                        request = json.loads(receive_line(connection))
+                        if not isinstance(request, dict): raise ValueError("request must be a JSON object")
+                        response = self.handle(request)
+                    except Exception as error:
+                        request = {}
+                        response = {"status": "error", "message": f"bad request, {type(error).__name__}: {error}"}
+                    try:
+                        connection.sendall((json.dumps(response) + "\n").encode())
+                    except OSError as error:
+                        print(f"Could not send response: {error}")
+                if request.get("command") == "shutdown": break
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+def receive_line(connection):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk: break
+        data += chunk
+    return data.decode()
+
+def send_request(socket_path, request):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    with client:
+        client.sendall((json.dumps(request) + "\n").encode())
+        return json.loads(receive_line(client))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", help=f"Unix socket path (default: {DEFAULT_SOCKET})", default=DEFAULT_SOCKET)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Start the server")
+    serve_parser.add_argument("--watch-make", help="Rerun make_histograms.py whenever this YAML spec file changes", default=None)
+    serve_parser.add_argument("--watch-plot", help="Rerun plot_histograms.py whenever this plot YAML file changes", default=None)
+    serve_parser.add_argument("--cache-size", help="Maximum number of histograms kept in memory, least recently used ones are dropped first (default: 100000)", type=int, default=100000)
+    make_parser = subparsers.add_parser("make", help="Ask the server to run make_histograms.py")
+    make_parser.add_argument("yamlpath", help="YAML spec file path")
+    make_parser.add_argument("--diagnosis", help="Create diagnosis file, showing event contributions from each input ROOT file", action="store_true")
+    make_parser.add_argument("--engine", help="Histogram filling engine, see make_histograms.py", choices=["formula", "project", "rdf"], default="formula")
+    plot_parser = subparsers.add_parser("plot", help="Ask the server to run plot_histograms.py")
+    plot_parser.add_argument("yamlpath", help="input YAML file path, not the same as input for make_histograms.py")
+    subparsers.add_parser("stats", help="Show request latencies and cache usage of the server")
+    subparsers.add_parser("shutdown", help="Stop the server")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        TopSFServer(args.socket, watch_make=args.watch_make, watch_plot=args.watch_plot, cache_size=args.cache_size).serve()
+    else:
+        request = {"command": args.command}
+        if args.command in ["make", "plot"]: request["spec"] = os.path.abspath(args.yamlpath)
+        if args.command == "make":
+            request["diagnosis"] = args.diagnosis
+            request["engine"] = args.engine
+        response = send_request(args.socket, request)
+        print(json.dumps(response, indent=2))
+        if response["status"] != "ok": raise SystemExit(1)
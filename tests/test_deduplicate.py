@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+pyr = pytest.importorskip("ROOT")
+import deduplicate
+
+def test_read_event_ids_exact_above_2_53(tmp_path):
+    filename = str(tmp_path / "events.root")
+    # Consecutive event numbers above 2^53 are merged when read through double
+    rdf = pyr.RDataFrame(10).Define("run", "(UInt_t) 1").Define("luminosityBlock", "(UInt_t) (rdfentry_ / 5)")
+    rdf = rdf.Define("event", "(ULong64_t) 9007199254740993ULL + rdfentry_")
+    rdf.Snapshot("Events", filename, ["run", "luminosityBlock", "event"])
+    chunks = list(deduplicate.read_event_ids(filename, "Events", deduplicate.DEFAULT_BRANCHES, chunksize=4))
+    assert [first for first, _, _, _ in chunks] == [0, 4, 8]
+    event = np.concatenate([chunk[3] for chunk in chunks])
+    assert event.dtype == np.uint64
+    np.testing.assert_array_equal(event, np.uint64(9007199254740993) + np.arange(10, dtype=np.uint64))
+    lumi = np.concatenate([chunk[2] for chunk in chunks])
+    np.testing.assert_array_equal(lumi, np.arange(10) // 5)
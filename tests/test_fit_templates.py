@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+pytest.importorskip("scipy")
+from fit_templates import morph_delta, smooth_step
+
+DELTA_UP = 3.
+DELTA_DOWN = -1.
+
+def combine_morph(x):
+    # Vertical template morphing of HiggsCombine for |x| < 1
+    return 0.5*x*(DELTA_UP - DELTA_DOWN) + 0.5*x*smooth_step(x)*(DELTA_UP + DELTA_DOWN)
+
+def test_morph_delta_at_one_sigma():
+    assert morph_delta(1., DELTA_UP, DELTA_DOWN) == pytest.approx(DELTA_UP)
+    assert morph_delta(-1., DELTA_UP, DELTA_DOWN) == pytest.approx(DELTA_DOWN)
+
+def test_morph_delta_continuous_at_one_sigma():
+    for x in [-1., 1.]:
+        inside = morph_delta(x*(1 - 1e-6), DELTA_UP, DELTA_DOWN)
+        outside = morph_delta(x*(1 + 1e-6), DELTA_UP, DELTA_DOWN)
+        assert inside == pytest.approx(outside, abs=1e-4)
+
+def test_morph_delta_matches_combine():
+    for x in [-0.5, 0.5]:
+        assert morph_delta(x, DELTA_UP, DELTA_DOWN) == pytest.approx(combine_morph(x))
+    assert morph_delta(0.5, DELTA_UP, DELTA_DOWN) == pytest.approx(1.3965, abs=1e-4)
+    assert morph_delta(-0.5, DELTA_UP, DELTA_DOWN) == pytest.approx(-0.6035, abs=1e-4)
+
+def test_morph_delta_zero_at_nominal():
+    assert morph_delta(np.zeros(3), DELTA_UP, DELTA_DOWN) == pytest.approx(np.zeros(3))
+
+def test_lnn_log_kappas():
+    from fit_templates import lnn_log_kappas
+    assert lnn_log_kappas(1.05) == pytest.approx((-np.log(1.05), np.log(1.05)))
+    assert lnn_log_kappas("0.95/1.05") == pytest.approx((np.log(0.95), np.log(1.05)))
+    for value in ["abc", "0.9/1.0/1.1", "-1.05"]:
+        with pytest.raises(ValueError, match="lnN size"):
+            lnn_log_kappas(value)
+
+def test_lnn_exponent():
+    from fit_templates import lnn_exponent
+    down, up = np.log(0.95), np.log(1.10)
+    assert lnn_exponent(1., down, up) == pytest.approx(up)
+    assert lnn_exponent(-1., down, up) == pytest.approx(down)
+    assert lnn_exponent(2., -up, up) == pytest.approx(2*up)
+    assert lnn_exponent(0.5*(1 - 1e-6), down, up) == pytest.approx(lnn_exponent(0.5*(1 + 1e-6), down, up), abs=1e-6)
+
+def test_shape_scale_and_category():
+    from fit_templates import TemplateFitModel
+    nominal = np.ones((2, 2, 3))
+    shape_up = nominal[None] + 2.
+    shape_down = nominal[None] - 1.
+    # Shape uncertainty with size 0.5 on the first tagging category only, as written in the datacard
+    model = TemplateFitModel(
+        ["a", "b"], nominal, np.zeros(nominal.shape), ["shape"], shape_up, shape_down, [], np.zeros((0, 2)),
+        np.full((2, 3), 2.), 1., mcstats=False, shape_scale=np.array([[0.5, 0.]])
+    )
+    expected, _ = model.expected_per_category(np.array([1., 1., 2.]))
+    np.testing.assert_allclose(expected[:, 0], 1. + 2.)
+    np.testing.assert_allclose(expected[:, 1], 1.)
+    expected, _ = model.expected_per_category(np.array([1., 1., 1.]))
+    np.testing.assert_allclose(expected[:, 0], 1. + morph_delta(0.5, 2., -1.))
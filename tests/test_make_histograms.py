@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pyr = pytest.importorskip("ROOT")
+import make_histograms as mh
+
+BOOKINGS = [
+    {"var": "x", "cut": "x > 1", "weight": "w", "xbins": 10, "xmin": 0, "xmax": 5},
+    {"var": "x", "cut": "njet >= 2", "weight": "w*1.5", "xbins": 7, "xmin": -1, "xmax": 4},
+    {"var": "jet_pt", "cut": "1", "weight": "w", "xbins": 8, "xmin": 0, "xmax": 80},
+    {"var": "jet_pt", "cut": "jet_pt > 20", "weight": "1", "xbins": 8, "xmin": 0, "xmax": 80},
+    {"var": "x", "cut": "jet_pt[0] > 30", "weight": "w", "xbins": 5, "xmin": 0, "xmax": 5},
+    {"var": "Sum$(jet_pt)", "cut": "njet > 0", "weight": "w", "xbins": 10, "xmin": 0, "xmax": 200},
+]
+
+@pytest.fixture
+def tree_file(tmp_path):
+    filename = str(tmp_path / "tree.root")
+    pyr.gInterpreter.Declare("""
+    ROOT::RVecF topsf_test_jet_pt(int njet, ULong64_t entry) {
+        ROOT::RVecF pt(njet);
+        for (int i = 0; i < njet; i++) pt[i] = 10 + (entry * 7 + i * 13) % 60;
+        return pt;
+    }
+    """)
+    rdf = pyr.RDataFrame(500).Define("x", "float(rdfentry_ % 53) / 10.f").Define("w", "1.f + float(rdfentry_ % 7) / 10.f")
+    rdf = rdf.Define("njet", "int(rdfentry_ % 4)").Define("jet_pt", "topsf_test_jet_pt(njet, rdfentry_)")
+    rdf.Snapshot("Events", filename, ["x", "w", "njet", "jet_pt"])
+    return filename
+
+def bookings_for(engine):
+    return [dict(b, histname=f"h{i}_{engine}") for i, b in enumerate(BOOKINGS)]
+
+def assert_same_histograms(reference, candidate):
+    for ref, cand in zip(reference, candidate):
+        assert ref.GetNbinsX() == cand.GetNbinsX()
+        for i in range(ref.GetNbinsX() + 2):
+            assert cand.GetBinContent(i) == pytest.approx(ref.GetBinContent(i), rel=1e-6, abs=1e-9)
+            assert cand.GetBinError(i) == pytest.approx(ref.GetBinError(i), rel=1e-6, abs=1e-9)
+
+@pytest.mark.parametrize("engine", ["formula", "rdf"])
+def test_engine_matches_project(tree_file, engine):
+    # Cuts on array branches are only supported by TTree.Project expressions, not by the rdf engine
+    bookings = BOOKINGS if engine == "formula" else BOOKINGS[:3]
+    reference = mh.extract_file_histograms(tree_file, "Events", bookings_for("project")[:len(bookings)], engine="project")
+    candidate = mh.extract_file_histograms(tree_file, "Events", bookings_for(engine)[:len(bookings)], engine=engine)
+    assert reference[0].GetEntries() > 0
+    assert_same_histograms(reference, candidate)
+
+@pytest.mark.parametrize("engine", ["formula", "rdf"])
+def test_engine_matches_project_with_exclude(tree_file, engine):
+    exclude = np.array([0, 3, 4, 100, 499], dtype=np.int64)
+    reference = mh.extract_file_histograms(tree_file, "Events", bookings_for("project")[:3], engine="project", exclude=exclude)
+    candidate = mh.extract_file_histograms(tree_file, "Events", bookings_for(engine)[:3], engine=engine, exclude=exclude)
+    assert_same_histograms(reference, candidate)
+
+def test_hist2d_to_replicas_shape():
+    nbins, nreplicas = 6, 4
+    hist = pyr.TH2D("test_replicas", "test_replicas", nbins, 0, nbins, nreplicas, 0, nreplicas)
+    for replica in range(nreplicas):
+        for i in range(nbins):
+            hist.SetBinContent(i+1, replica+1, 10*replica + i)
+    hist.SetBinContent(0, 1, 1000)
+    hist.SetBinContent(nbins+1, nreplicas, 1000)
+    replicas = mh.hist2d_to_replicas(hist)
+    assert replicas.shape == (nreplicas, nbins)
+    assert replicas.dtype == np.float64
+    expected = 10*np.arange(nreplicas)[:, None] + np.arange(nbins)[None, :]
+    np.testing.assert_array_equal(replicas, expected)
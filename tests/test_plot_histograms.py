@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+pytest.importorskip("mplhep")
+pytest.importorskip("ROOT")
+import plot_histograms as ph
+
+YAML_SPEC = {
+    "lumi": 138,
+    "xlabel": "mass",
+    "formats": ["png"],
+    "categories": {
+        "signal": {"propername": "Signal", "color": "#5790fc"},
+        "background": {"propername": "Background", "color": "#f89c20"},
+    },
+}
+
+def render_prefit(renderer, basename, scale):
+    histbins = [0., 50., 100., 150., 200.]
+    array_mc = {"signal": scale*np.array([1., 3., 2., 0.5]), "background": scale*np.array([2., 2., 1., 1.])}
+    array_mc_error = {category: np.sqrt(values) for category, values in array_mc.items()}
+    array_mc_sum = sum(array_mc.values())
+    array_data = array_mc_sum*1.1
+    array_data_err = np.sqrt(array_data)
+    renderer.render("prefit", basename, array_mc, array_mc_error, array_mc_sum, array_data, array_data_err, histbins, f"scale {scale}")
+
+def test_reused_figure_keeps_ytick_labels(tmp_path):
+    # Event categories with very different y ranges, so that the reused figure gets more ticks than before
+    renderer = ph.Renderer(YAML_SPEC)
+    try:
+        for i, scale in enumerate([0.3, 7., 1., 65., 2.2, 40000.]):
+            basename = str(tmp_path / f"prefit_{i}")
+            render_prefit(renderer, basename, scale)
+            assert (tmp_path / f"prefit_{i}.png").exists()
+            main_ax = renderer.figure("prefit").main_ax
+            ymin, ymax = main_ax.get_ylim()
+            ticks = main_ax.yaxis.get_major_ticks()
+            locs = main_ax.yaxis.get_majorticklocs()
+            assert locs[0] == 0 and not ticks[0].label1.get_visible()
+            for tick, loc in zip(ticks[1:], locs[1:]):
+                if ymin < loc <= ymax: assert tick.label1.get_visible(), f"label at {loc} hidden for scale {scale}"
+    finally:
+        renderer.close()
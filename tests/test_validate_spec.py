@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("ROOT")
+from validate_spec import check_spec_structure
+
+def minimal_spec():
+    return {
+        "year": 2018, "lumi": 59.8, "lumiunit": "fb", "genweight": "genWeight", "treename": "Events", "basecut": "1",
+        "processes": {"data": {"nominal_files": ["data.root"]}, "ttbar": {"nominal_files": ["ttbar.root"]}},
+        "categories": {"matched": {"processes": ["ttbar"], "cut": "matched"}},
+        "tagger": {"varname": "score", "cut": 0.5},
+        "distribution": {"mass_variable": "mass", "mass_range": [0, 300], "mass_bins": 30, "event_categories": [{"name": "all", "rule": "1"}]},
+        "uncertainties": {"lumi": {"mode": "lnN", "size": 1.025}},
+    }
+
+def test_valid_spec_has_no_errors():
+    assert check_spec_structure(minimal_spec()) == []
+
+def test_missing_nested_keys_are_reported_together():
+    spec = minimal_spec()
+    del spec["categories"]["matched"]["processes"]
+    del spec["uncertainties"]["lumi"]["mode"]
+    spec["distribution"]["event_categories"].append({"name": "high"})
+    errors = check_spec_structure(spec)
+    assert "spec: category 'matched' has no 'processes' key" in errors
+    assert "spec: uncertainty 'lumi' has no 'mode' key" in errors
+    assert "spec: event category high has no 'rule' key" in errors
+    assert len(errors) == 3
@@ -0,0 +1,197 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import ROOT as pyr
+import yaml
+
+def tagger_cuts(yaml_spec):
+    if "cutrule" in yaml_spec["tagger"].keys():
+        tagger_cut_pass = yaml_spec["tagger"]["cutrule"]
+        tagger_cut_fail = f"!({tagger_cut_pass})"
+    else:
+        tagger_varname = yaml_spec["tagger"]["varname"]
+        tagger_cut_pass = f'{tagger_varname}>={yaml_spec["tagger"]["cut"]}'
+        tagger_cut_fail = f'{tagger_varname}<{yaml_spec["tagger"]["cut"]}'
+    return tagger_cut_pass, tagger_cut_fail
+
+def check_spec_structure(yaml_spec):
+    # Checks that do not need any input file, e.g. missing keys and cross references between keys
+    errors = []
+    for key in ["year", "lumi", "lumiunit", "genweight", "treename", "processes", "basecut", "categories", "tagger", "distribution", "uncertainties"]:
+        if key not in yaml_spec.keys(): errors.append(f"spec: required key '{key}' is missing")
+    if errors: return errors
+
+    if "data" not in yaml_spec["processes"].keys(): errors.append("spec: 'processes' must contain a 'data' process")
+    for process, process_config in yaml_spec["processes"].items():
+        if "nominal_files" not in process_config.keys(): errors.append(f"spec: process '{process}' has no 'nominal_files' key")
+    for category, category_config in yaml_spec["categories"].items():
+        for key in ["processes", "cut"]:
+            if key not in category_config.keys(): errors.append(f"spec: category '{category}' has no '{key}' key")
+        for process in category_config.get("processes", []):
+            if process not in yaml_spec["processes"].keys():
+                errors.append(f"spec: category '{category}' refers to process '{process}', which is not defined in 'processes'")
+
+    if "cutrule" not in yaml_spec["tagger"].keys():
+        for key in ["varname", "cut"]:
+            if key not in yaml_spec["tagger"].keys(): errors.append(f"spec: tagger has neither 'cutrule' nor '{key}' key")
+
+    for key in ["mass_variable", "mass_range", "mass_bins", "event_categories"]:
+        if key not in yaml_spec["distribution"].keys(): errors.append(f"spec: distribution has no '{key}' key")
+    for e in yaml_spec["distribution"].get("event_categories", []):
+        for key in ["name", "rule"]:
+            if key not in e.keys(): errors.append(f"spec: event category {e.get('name', e)} has no '{key}' key")
+    for extra in yaml_spec["distribution"].get("extra_variables", []):
+        for key in ["name", "variable", "range", "bins"]:
+            if key not in extra.keys(): errors.append(f"spec: extra variable {extra.get('name', extra)} has no '{key}' key")
+
+    for unc, unc_config in yaml_spec["uncertainties"].items():
+        mode = unc_config.get("mode")
+        if mode is None: errors.append(f"spec: uncertainty '{unc}' has no 'mode' key")
+        elif mode not in ["lnN", "factor", "file"]: errors.append(f"spec: uncertainty '{unc}' has mode '{mode}', must be lnN, factor or file")
+        if mode == "factor":
+            for direction in ["up", "down"]:
+                if direction not in unc_config.keys(): errors.append(f"spec: factor uncertainty '{unc}' has no '{direction}' expression")
+        elif mode == "file":
+            for process in yaml_spec["processes"].keys():
+                if process == "data": continue
+                unc_files = yaml_spec["processes"][process].get("unc_files", {})
+                if unc not in unc_files.keys():
+                    errors.append(f"spec: file uncertainty '{unc}' has no 'unc_files' entry in process '{process}'")
+                    continue
+                for direction in ["up", "down"]:
+                    if direction not in unc_files[unc].keys(): errors.append(f"spec: file uncertainty '{unc}' of process '{process}' has no '{direction}' files")
+        if "category" in unc_config.keys() and unc_config["category"] not in yaml_spec["categories"].keys():
+            errors.append(f"spec: uncertainty '{unc}' refers to category '{unc_config['category']}', which is not defined in 'categories'")
+
+    if "perfileweights" in yaml_spec.keys():
+        listed_files = set(spec_files(yaml_spec))
+        for weightset in yaml_spec["perfileweights"]:
+            for key in ["name", "value", "files"]:
+                if key not in weightset.keys(): errors.append(f"spec: perfileweights {weightset.get('name', weightset)} has no '{key}' key")
+            for filename in weightset.get("files", []):
+                if filename not in listed_files:
+                    errors.append(f"spec: perfileweights '{weightset.get('name')}' targets {filename}, which is not listed in 'processes'")
+    return errors
+
+def spec_files(yaml_spec):
+    filelist = []
+    for process, process_config in yaml_spec["processes"].items():
+        filelist += process_config.get("nominal_files", [])
+        if process == "data": continue
+        for unc_config in process_config.get("unc_files", {}).values():
+            filelist += unc_config.get("up", []) + unc_config.get("down", [])
+    return filelist
+
+def spec_expressions(yaml_spec):
+    # Every expression that TTree.Project will see for each input file, labelled by where it comes from in the spec
+    expressions = {}
+    def add(filepath, label, expression):
+        expressions.setdefault(filepath, {})
+        expressions[filepath][label] = str(expression)
+
+    tagger_cut_pass, _ = tagger_cuts(yaml_spec)
+    common = [
+        ("basecut", yaml_spec["basecut"]),
+        ("distribution.mass_variable", yaml_spec["distribution"]["mass_variable"]),
+        ("tagger", tagger_cut_pass),
+    ]
+    common += [(f"event category '{e.get('name')}' rule", e.get("rule")) for e in yaml_spec["distribution"]["event_categories"]]
+    common += [(f"extra variable '{e['name']}'", e["variable"]) for e in yaml_spec["distribution"].get("extra_variables", [])]
+
+    unc_factor = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc].get("mode") == "factor"]
+    unc_file = [unc for unc in yaml_spec["uncertainties"].keys() if yaml_spec["uncertainties"][unc].get("mode") == "file"]
+
+    for process, process_config in yaml_spec["processes"].items():
+        if process == "data":
+            for filepath in process_config["nominal_files"]:
+                for label, expression in common: add(filepath, label, expression)
+                if process_config.get("deduplicate", False):
+                    for branch in process_config.get("dedup_branches", ["run", "luminosityBlock", "event"]): add(filepath, f"data deduplication branch '{branch}'", branch)
+            continue
+        process_expressions = list(common)
+        process_expressions.append(("genweight", yaml_spec["genweight"]))
+        if "additional_weights" in process_config.keys():
+            process_expressions.append((f"process '{process}' additional_weights", process_config["additional_weights"]))
+        for category, category_config in yaml_spec["categories"].items():
+            if process in category_config.get("processes", []):
+                process_expressions.append((f"category '{category}' cut", category_config["cut"]))
+
+        for filepath in process_config["nominal_files"]:
+            for label, expression in process_expressions: add(filepath, label, expression)
+            for unc in unc_factor:
+                for direction in ["up", "down"]:
+                    if direction in yaml_spec["uncertainties"][unc].keys():
+                        add(filepath, f"uncertainty '{unc}' {direction} weight", yaml_spec["uncertainties"][unc][direction])
+        for unc in unc_file:
+            unc_config = process_config.get("unc_files", {}).get(unc, {})
+            for filepath in unc_config.get("up", []) + unc_config.get("down", []):
+                for label, expression in process_expressions: add(filepath, label, expression)
+    return expressions
+
+def check_file(filepath, treename, expressions, added_branches):
+    pyr.gErrorIgnoreLevel = pyr.kFatal
+    fileobj = pyr.TFile.Open(filepath, "READ")
+    if not fileobj or fileobj.IsZombie(): return [f"{filepath}: cannot open file"]
+    treeobj = fileobj.Get(treename)
+    if not treeobj or not treeobj.InheritsFrom("TTree"):
+        fileobj.Close()
+        return [f"{filepath}: tree '{treename}' not found"]
+
+    # Branches from perfileweights do not exist yet, they are only added right before filling
+    for branchname in added_branches:
+        if not treeobj.GetBranch(branchname): treeobj.SetAlias(branchname, "1")
+
+    errors = []
+    formulas = []
+    for i, (label, expression) in enumerate(expressions.items()):
+        formula = pyr.TTreeFormula(f"topsf_validate_{i}", expression, treeobj)
+        if formula.GetNdim() == 0: errors.append(f"{filepath}: {label} '{expression}' does not resolve in tree '{treename}'")
+        formulas.append(formula)
+    del formulas
+    fileobj.Close()
+    return errors
+
+def validate_spec(yaml_spec, max_workers=None):
+    errors = check_spec_structure(yaml_spec)
+    if errors: return errors
+
+    added_branches = {}
+    if "perfileweights" in yaml_spec.keys():
+        for weightset in yaml_spec["perfileweights"]:
+            for filename in weightset["files"]:
+                added_branches.setdefault(filename, []).append(weightset["name"])
+
+    expressions = spec_expressions(yaml_spec)
+    filelist = list(expressions.keys())
+    # Workers are spawned, not forked, since the caller may already hold ROOT state and open files (e.g. serve.py)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        file_errors = executor.map(
+            check_file,
+            filelist,
+            [yaml_spec["treename"]]*len(filelist),
+            [expressions[filepath] for filepath in filelist],
+            [added_branches.get(filepath, []) for filepath in filelist],
+        )
+        for errorlist in file_errors: errors += errorlist
+    return errors
+
+def print_report(errors):
+    print("===========================")
+    if not errors:
+        print("Spec validation passed")
+        return
+    print(f"Spec validation failed with {len(errors)} error(s):")
+    for error in errors: print(f"  {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("yamlpath", help="YAML spec file path, same as input for make_histograms.py")
+    parser.add_argument("-j", "--jobs", help="Number of files opened concurrently (default: number of CPUs)", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.yamlpath, "r") as yamlfile:
+        yaml_spec = yaml.safe_load(yamlfile)
+
+    errors = validate_spec(yaml_spec, max_workers=args.jobs)
+    print_report(errors)
+    if errors: raise SystemExit(1)